@@ -2,12 +2,17 @@ import cv2
 from moviepy import editor as mp
 from moviepy.video.fx import fadein, fadeout
 import streamlit as st
-from transformers import pipeline
-from PIL import Image
+import numpy as np
 import os
 import logging
+import queue
 import tempfile
+import threading
 import shutil  # Import shutil for directory removal
+from ffmpeg_utils import (
+    can_concat_copy, concat_segments, h264_codec_args, h264_encoder, has_audio, mp4_compatible, on_keyframes,
+    probe_duration, run_ffmpeg
+)
 
 # Logger Setup
 logger = logging.getLogger(__name__)
@@ -21,85 +26,219 @@ stream_handler.setFormatter(formatter)
 logger.addHandler(file_handler)
 logger.addHandler(stream_handler)
 
+# Number of sampled frames classified per model call
+BATCH_SIZE = 16
+
+@st.cache_resource
+def get_emotion_pipeline():
+    """Load the facial emotion classifier once per process."""
+    # Imported here so pages that never classify frames don't pay for torch and transformers
+    import torch
+    from transformers import pipeline
+
+    device = 0 if torch.cuda.is_available() else -1
+    return pipeline("image-classification", model="dima806/facial_emotions_image_detection", device=device)
+
+def classify_frames(emotion_detector, frames, top_k=5):
+    """
+    Classify a batch of (frame_count, bgr_frame) samples in a single forward pass.
+    Resizing, BGR->RGB conversion and normalization run as tensor ops on the model's
+    device instead of going through PIL in the HF pipeline.
+    """
+    import torch
+    from torchvision.transforms import v2
+
+    model = emotion_detector.model
+    processor = emotion_detector.image_processor
+    device = emotion_detector.device
+    size = (processor.size.get("height", 224), processor.size.get("width", 224))
+    resize = v2.Resize(size, antialias=True)
+    normalize = v2.Compose([
+        v2.ToDtype(torch.float32, scale=True),
+        v2.Normalize(mean=processor.image_mean, std=processor.image_std),
+    ])
+
+    try:
+        batch = torch.from_numpy(np.stack([frame for _, frame in frames]))
+        if device.type == "cuda":
+            batch = batch.pin_memory()
+        # NHWC BGR uint8 -> NCHW RGB
+        batch = batch.to(device, non_blocking=True).permute(0, 3, 1, 2).flip(1)
+        thumbnails = resize(batch)
+        logits = model(pixel_values=normalize(thumbnails).to(model.dtype)).logits
+        scores, indices = logits.softmax(-1).topk(min(top_k, logits.shape[-1]))
+    except Exception as e:
+        logger.error("Error processing frames %s-%s: %s", frames[0][0], frames[-1][0], e)
+        return []
+
+    labels = model.config.id2label
+    images = thumbnails.permute(0, 2, 3, 1).cpu().numpy()
+    return [
+        {
+            "frame": frame_count,
+            "emotions": [
+                {"label": labels[index], "score": score}
+                for score, index in zip(frame_scores, frame_indices)
+            ],
+            "image": image
+        }
+        for (frame_count, _), frame_scores, frame_indices, image
+        in zip(frames, scores.tolist(), indices.tolist(), images)
+    ]
+
+def read_sampled_frames(cap, frame_counts, frame_queue, stop):
+    """Decode the sampled frames on a worker thread until stop is set, ending the stream with None."""
+    try:
+        position = 0  # Index of the frame the next read returns
+        for frame_count in frame_counts:
+            if stop.is_set():
+                break
+            # Step over the frames in between with grab(), which skips the color conversion; seeking
+            # would decode forward again from the previous keyframe for every sample
+            while position < frame_count - 1 and cap.grab():
+                position += 1
+            ret, frame = cap.read()
+            position += 1
+            if not ret:
+                break
+            frame_queue.put((frame_count, frame))
+    except Exception as e:
+        logger.error("Error decoding video frames: %s", e)
+    finally:
+        frame_queue.put(None)
+
 def analyze_footage(video_path):
     """Analyze video footage to detect key moments with emotions."""
+    import torch
+
     logger.info("Analyzing video footage...")
     cap = cv2.VideoCapture(video_path)
     fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    step = max(int(fps * 1), 1)  # Sample every 1 second
     key_moments = []
-    frame_count = 0
 
     try:
-        emotion_detector = pipeline("image-classification", model="dima806/facial_emotions_image_detection")
+        emotion_detector = get_emotion_pipeline()
     except Exception as e:
         logger.error("Error loading emotion detection model: %s", e)
         cap.release()
         return []
 
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        frame_count += 1
-        if frame_count % int(fps * 1) == 0:  # Sample every 1 second
+    # Decoding runs on a worker thread so the next batch is read while the model runs
+    stop = threading.Event()
+    frame_queue = queue.Queue(maxsize=BATCH_SIZE)
+    reader = threading.Thread(
+        target=read_sampled_frames,
+        args=(cap, range(step, total_frames + 1, step), frame_queue, stop),
+        daemon=True
+    )
+    reader.start()
+
+    batch = []
+    try:
+        with torch.inference_mode():
+            while True:
+                sample = frame_queue.get()
+                if sample is None:
+                    break
+
+                batch.append(sample)
+                if len(batch) >= BATCH_SIZE:
+                    key_moments.extend(classify_frames(emotion_detector, batch))
+                    batch = []
+
+            if batch:
+                key_moments.extend(classify_frames(emotion_detector, batch))
+    finally:
+        # Also runs when a Streamlit rerun interrupts the script, so the reader never stays blocked
+        stop.set()
+        while reader.is_alive():
+            # Unblock a reader waiting on a full queue
             try:
-                resized_frame = cv2.resize(frame, (224, 224))
-                rgb_frame = cv2.cvtColor(resized_frame, cv2.COLOR_BGR2RGB)
-                pil_image = Image.fromarray(rgb_frame)
-                emotions = emotion_detector(pil_image)
-                key_moments.append({
-                    "frame": frame_count,
-                    "emotions": emotions,
-                    "image": rgb_frame
-                })
-            except Exception as e:
-                logger.error("Error processing frame %s: %s", frame_count, e)
-
-    cap.release()
+                frame_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        reader.join()
+        cap.release()
     logger.info("Video footage analysis completed.")
     return key_moments
 
+def merge_intervals(intervals):
+    """Merge overlapping (start, end) intervals with a vectorized sweep over the sorted starts."""
+    if not intervals:
+        return []
+    times = np.array(sorted(intervals), dtype=np.float64)
+    starts, ends = times[:, 0], times[:, 1]
+    running_end = np.maximum.accumulate(ends)
+    # A new group begins wherever an interval starts after everything before it has ended
+    group_starts = np.concatenate(([0], np.flatnonzero(starts[1:] > running_end[:-1]) + 1))
+    return list(zip(starts[group_starts].tolist(), np.maximum.reduceat(ends, group_starts).tolist()))
+
+def highlight_filter_graph(intervals, with_audio):
+    """Build a filter graph that cuts the (start, end) intervals out of input 0 and joins them in order."""
+    filters = []
+    outputs = []
+    for i, (start, end) in enumerate(intervals):
+        filters.append(f"[0:v]trim=start={start:.3f}:end={end:.3f},setpts=PTS-STARTPTS[v{i}]")
+        outputs.append(f"[v{i}]")
+        if with_audio:
+            filters.append(f"[0:a]atrim=start={start:.3f}:end={end:.3f},asetpts=PTS-STARTPTS[a{i}]")
+            outputs.append(f"[a{i}]")
+    audio_output = "[aout]" if with_audio else ""
+    filters.append(f"{''.join(outputs)}concat=n={len(intervals)}:v=1:a={int(with_audio)}[vout]{audio_output}")
+    return ";".join(filters)
+
 def generate_highlight_reel(video_path, key_moments, selected_emotions, output_path):
     """Generate a highlight reel based on user-selected emotions."""
     logger.info("Generating highlight reel...")
     try:
-        clip = mp.VideoFileClip(video_path)
-        fps = clip.fps
+        cap = cv2.VideoCapture(video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        cap.release()
+        duration = probe_duration(video_path)
 
         # Collect highlight time intervals
+        selected = set(selected_emotions)
         highlight_times = []
         for moment in key_moments:
-            if any(selected_emo in [emo["label"] for emo in moment["emotions"]] for selected_emo in selected_emotions):
+            if not selected.isdisjoint(emo["label"] for emo in moment["emotions"]):
                 start_time = max((moment["frame"] / fps) - 2.5, 0)  # Start 2.5 seconds before
-                end_time = min((moment["frame"] / fps) + 2.5, clip.duration)  # End 2.5 seconds after
+                end_time = min((moment["frame"] / fps) + 2.5, duration)  # End 2.5 seconds after
                 highlight_times.append((start_time, end_time))
 
         # Merge overlapping time intervals
-        merged_times = []
-        for start, end in sorted(highlight_times):
-            if merged_times and start <= merged_times[-1][1]:
-                merged_times[-1] = (merged_times[-1][0], max(merged_times[-1][1], end))
-            else:
-                merged_times.append((start, end))
+        merged_times = merge_intervals(highlight_times)
 
-        # Create clips for each interval
+        # Create segments for each interval
         if not merged_times:
             logger.info("No highlights detected for the selected emotions.")
             return None
 
-        highlight_clips = []
+        segments = []
         for start, end in merged_times:
             # Ensure at least 5 seconds per highlight
             if end - start < 5:
                 padding = (5 - (end - start)) / 2
                 start = max(start - padding, 0)
-                end = min(end + padding, clip.duration)
-            highlight_clips.append(clip.subclip(start, end))
-
-        # Concatenate all highlight clips
-        final_highlight = mp.concatenate_videoclips(highlight_clips, method="compose")
-        final_highlight.write_videofile(output_path, codec="libx264", audio_codec="aac")
+                end = min(end + padding, duration)
+            segments.append((start, end))
+
+        # Stream-copy the segments when every cut falls on a keyframe (the end of the file needs none)
+        cut_times = [start for start, _ in segments] + [end for _, end in segments if end < duration]
+        if on_keyframes(video_path, cut_times):
+            concat_segments([(video_path, start, end) for start, end in segments], output_path)
+        else:
+            # Otherwise cut frame-accurately in one filter graph and re-encode once; the concat demuxer's
+            # inpoint would start each segment from the keyframe before it
+            with_audio = has_audio(video_path)
+            run_ffmpeg([
+                "-i", video_path,
+                "-filter_complex", highlight_filter_graph(segments, with_audio),
+                "-map", "[vout]", *(["-map", "[aout]"] if with_audio else []),
+                *h264_codec_args(), "-c:a", "aac",
+                output_path
+            ])
         logger.info("Highlight reel saved at: %s", output_path)
         return output_path
 
@@ -107,6 +246,23 @@ def generate_highlight_reel(video_path, key_moments, selected_emotions, output_p
         logger.error("Error generating highlight reel: %s", e)
         return None
 
+def concatenate_videos(video_paths, output_path):
+    """Join the uploaded videos, copying streams when they share MP4-compatible codecs and re-encoding once otherwise."""
+    if can_concat_copy(video_paths) and mp4_compatible(video_paths[0]):
+        concat_segments([(path, None, None) for path in video_paths], output_path)
+        return
+
+    logger.info("Uploaded videos differ in format, re-encoding them into one file.")
+    clips = [mp.VideoFileClip(path) for path in video_paths]
+    try:
+        codec, ffmpeg_params = h264_encoder()
+        mp.concatenate_videoclips(clips, method="compose").write_videofile(
+            output_path, codec=codec, ffmpeg_params=list(ffmpeg_params), audio_codec="aac"
+        )
+    finally:
+        for clip in clips:
+            clip.close()
+
 def show_emotion_based_highlight_reel():
     st.title("Emotion-Based Highlight Reel Creator 🎭")
     st.write("Upload multiple videos, detect emotions, and create a highlight reel based on selected emotions.")
@@ -119,7 +275,7 @@ def show_emotion_based_highlight_reel():
         for uploaded_file in uploaded_files:
             video_path = os.path.join(temp_dir, uploaded_file.name)
             with open(video_path, "wb") as f:
-                f.write(uploaded_file.read())
+                shutil.copyfileobj(uploaded_file, f, length=1 << 20)
             video_paths.append(video_path)
 
         for video_path in video_paths:
@@ -127,14 +283,8 @@ def show_emotion_based_highlight_reel():
 
         st.write("### Step 1: Analyze Combined Videos for Emotions")
 
-        def concatenate_videos(video_paths):
-            """Concatenate multiple video files into a single video."""
-            clips = [mp.VideoFileClip(path) for path in video_paths]
-            return mp.concatenate_videoclips(clips, method="compose")
-
-        concatenated_clip = concatenate_videos(video_paths)
         concatenated_path = os.path.join(temp_dir, "concatenated_video.mp4")
-        concatenated_clip.write_videofile(concatenated_path, codec="libx264", audio_codec="aac")
+        concatenate_videos(video_paths, concatenated_path)
 
         if st.button("Start Emotion Analysis"):
             st.write("Analyzing combined footage... Please wait.")
@@ -151,11 +301,12 @@ def show_emotion_based_highlight_reel():
                 return
 
             st.write("### Detected Frames with Emotions")
-            for moment in key_moments:
-                st.image(
-                    moment["image"],
-                    caption=f"Frame {moment['frame']} - {moment['emotions']}"
-                )
+            # One call renders all thumbnails as a grid instead of one element per frame
+            st.image(
+                [moment["image"] for moment in key_moments],
+                caption=[f"Frame {moment['frame']} - {moment['emotions']}" for moment in key_moments],
+                width=160
+            )
 
         if "key_moments" in st.session_state:
             key_moments = st.session_state.key_moments
@@ -1,32 +1,44 @@
 import cv2
-from diffusers import StableDiffusionPipeline
 from PIL import Image
-import torch
 import streamlit as st
 from fer import FER
 import numpy as np
-import pygame
+import io
 import os
+import functools
 import tempfile
 import shutil
 from datetime import datetime
-from moviepy.editor import ImageClip, AudioFileClip
+from moviepy.editor import ImageClip
+from moviepy.audio.AudioClip import AudioArrayClip
 from scipy.io import wavfile
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
+from ffmpeg_utils import h264_encoder
 
-# Initialize Spotify client
-client_credentials_manager = SpotifyClientCredentials(
-    client_id='647d6d6fd0af403bbeb245171f80505f',
-    client_secret='97d22dd241984ea48eb2ab65067180fc'
-)
-sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+# Sample rate of the generated music
+SAMPLE_RATE = 44100
 
-def detect_emotion_from_image(img):
+@st.cache_resource
+def get_spotify_client():
+    """Create the Spotify client once per process."""
+    client_credentials_manager = SpotifyClientCredentials(
+        client_id='647d6d6fd0af403bbeb245171f80505f',
+        client_secret='97d22dd241984ea48eb2ab65067180fc'
+    )
+    return spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+
+@st.cache_resource
+def get_fer():
+    """Load the FER detector and its MTCNN face model once per process."""
+    return FER(mtcnn=True)
+
+def detect_emotion_from_image(img, detector=None):
     try:
         if isinstance(img, Image.Image):
             img = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-        detector = FER(mtcnn=True)
+        if detector is None:
+            detector = get_fer()
         result = detector.detect_emotions(img)
         if result and len(result) > 0:
             emotions = result[0]['emotions']
@@ -39,28 +51,48 @@ def detect_emotion_from_image(img):
 
 def detect_emotion_from_video(video_path):
     cap = cv2.VideoCapture(video_path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    detector = get_fer()
     emotions = []
-    frame_count = 0
-    while cap.isOpened():
+    position = 0  # Index of the frame the next read returns
+    for frame_count in range(0, total_frames, 10):
+        # Grab the skipped frames without converting them instead of seeking back to a keyframe each time
+        while position < frame_count and cap.grab():
+            position += 1
         ret, frame = cap.read()
+        position += 1
         if not ret:
             break
-        if frame_count % 10 == 0:
-            try:
-                emotion = detect_emotion_from_image(frame)
-                emotions.append(emotion)
-            except Exception as e:
-                st.error(f"Error processing frame {frame_count}: {e}")
-        frame_count += 1
+        try:
+            emotion = detect_emotion_from_image(frame, detector)
+            emotions.append(emotion)
+        except Exception as e:
+            st.error(f"Error processing frame {frame_count}: {e}")
     cap.release()
     if emotions:
         return max(set(emotions), key=emotions.count)
     return "neutral"
 
-def generate_background(emotion):
+@st.cache_resource
+def get_sd_pipeline():
+    """Load Stable Diffusion once per process, in half precision on the GPU when one is available."""
+    # Imported here so pages that never generate backgrounds don't pay for torch and diffusers
+    import torch
+    from diffusers import StableDiffusionPipeline, DPMSolverMultistepScheduler
+
     model_id = "runwayml/stable-diffusion-v1-5"
-    pipe = StableDiffusionPipeline.from_pretrained(model_id, torch_dtype=torch.float32)
-    pipe = pipe.to("cpu")
+    use_cuda = torch.cuda.is_available()
+    pipe = StableDiffusionPipeline.from_pretrained(
+        model_id, torch_dtype=torch.float16 if use_cuda else torch.float32
+    )
+    pipe.scheduler = DPMSolverMultistepScheduler.from_config(pipe.scheduler.config)
+    pipe.enable_attention_slicing()
+    return pipe.to("cuda" if use_cuda else "cpu")
+
+def generate_background(emotion):
+    import torch
+
+    pipe = get_sd_pipeline()
     emotion_prompts = {
         "happy": "a bright sunny day in a beautiful garden with blooming flowers, cheerful atmosphere",
         "sad": "a rainy day with gray clouds, melancholic atmosphere, gentle rain falling",
@@ -71,21 +103,14 @@ def generate_background(emotion):
         "disgust": "abstract dark pattern with moody lighting",
     }
     prompt = emotion_prompts.get(emotion.lower(), "beautiful landscape with natural lighting")
-    with torch.no_grad():
-        image = pipe(prompt, num_inference_steps=20).images[0]
+    with torch.inference_mode():
+        image = pipe(prompt, num_inference_steps=15).images[0]
     return image
 
 def generate_music(emotion, duration=5):
+    """Synthesize a short int16 mono melody for an emotion, kept in memory."""
     try:
-        pygame.mixer.init(frequency=44100)
-        sample_rate = 44100
-        def generate_tone(frequency, duration, volume=0.5):
-            t = np.linspace(0, duration, int(sample_rate * duration))
-            tone = np.sin(2 * np.pi * frequency * t)
-            return (tone * volume * 32767).astype(np.int16)
-        def save_temp_music(audio_data, filename="temp_music.wav"):
-            wavfile.write(filename, sample_rate, audio_data)
-            return filename
+        sample_rate = SAMPLE_RATE
         emotion_music = {
             "happy": {"frequencies": [392, 440, 494, 523], "rhythm": 0.2, "volume": 0.6},
             "sad": {"frequencies": [440, 415, 392, 370], "rhythm": 0.4, "volume": 0.4},
@@ -96,60 +121,65 @@ def generate_music(emotion, duration=5):
             "disgust": {"frequencies": [466, 415, 392, 370], "rhythm": 0.2, "volume": 0.5}
         }
         params = emotion_music.get(emotion.lower(), emotion_music["neutral"])
-        music_data = np.array([], dtype=np.int16)
-        for _ in range(int(duration / params["rhythm"])):
-            freq = np.random.choice(params["frequencies"])
-            tone = generate_tone(freq, params["rhythm"], params["volume"])
-            music_data = np.concatenate([music_data, tone])
-        timestamp = int(time.time())
-        temp_file = f"temp_music_{timestamp}.wav"
-        save_temp_music(music_data, temp_file)
-        pygame.mixer.music.load(temp_file)
-        pygame.mixer.music.play()
-        return temp_file
+        n_beats = int(duration / params["rhythm"])
+        samples_per_beat = int(sample_rate * params["rhythm"])
+        freqs = np.random.choice(params["frequencies"], n_beats)
+        t = np.arange(samples_per_beat) / sample_rate
+        # One tone per beat, synthesized for all beats at once into a single buffer
+        music_data = np.empty(n_beats * samples_per_beat, dtype=np.int16)
+        music_data.reshape(n_beats, samples_per_beat)[:] = (
+            np.sin(2 * np.pi * freqs[:, None] * t[None, :]) * params["volume"] * 32767
+        ).astype(np.int16)
+        return music_data
     except Exception as e:
         st.error(f"Error generating music: {e}")
         return None
 
+@functools.lru_cache(maxsize=32)
+def fetch_spotify_recommendations(emotion):
+    """Query Spotify for tracks matching an emotion; results are cached per emotion."""
+    emotion_params = {
+        "happy": {"seed_genres": ["pop", "dance", "disco"], "target_valence": 0.8, "target_energy": 0.8, "limit": 5},
+        "sad": {"seed_genres": ["classical", "piano", "indie"], "target_valence": 0.2, "target_energy": 0.3, "limit": 5},
+        "angry": {"seed_genres": ["metal", "rock", "punk"], "target_valence": 0.3, "target_energy": 0.9, "limit": 5},
+        "fear": {"seed_genres": ["ambient", "classical", "instrumental"], "target_valence": 0.3, "target_energy": 0.4, "limit": 5},
+        "surprise": {"seed_genres": ["electronic", "dance", "pop"], "target_valence": 0.7, "target_energy": 0.7, "limit": 5},
+        "neutral": {"seed_genres": ["indie", "alternative", "folk"], "target_valence": 0.5, "target_energy": 0.5, "limit": 5},
+        "disgust": {"seed_genres": ["industrial", "electronic", "rock"], "target_valence": 0.3, "target_energy": 0.6, "limit": 5}
+    }
+    params = emotion_params.get(emotion, emotion_params["neutral"])
+    seed_genres = ",".join(params["seed_genres"])
+    recommendations = get_spotify_client().recommendations(
+        seed_genres=seed_genres,
+        target_valence=params["target_valence"],
+        target_energy=params["target_energy"],
+        limit=params["limit"]
+    )
+    songs = []
+    for track in recommendations['tracks']:
+        artists = ", ".join([artist['name'] for artist in track['artists']])
+        song_info = f"{track['name']} - {artists}"
+        song_url = track['external_urls']['spotify']
+        songs.append({'name': song_info, 'url': song_url})
+    return tuple(songs)
+
 def get_spotify_recommendations(emotion):
     try:
-        emotion_params = {
-            "happy": {"seed_genres": ["pop", "dance", "disco"], "target_valence": 0.8, "target_energy": 0.8, "limit": 5},
-            "sad": {"seed_genres": ["classical", "piano", "indie"], "target_valence": 0.2, "target_energy": 0.3, "limit": 5},
-            "angry": {"seed_genres": ["metal", "rock", "punk"], "target_valence": 0.3, "target_energy": 0.9, "limit": 5},
-            "fear": {"seed_genres": ["ambient", "classical", "instrumental"], "target_valence": 0.3, "target_energy": 0.4, "limit": 5},
-            "surprise": {"seed_genres": ["electronic", "dance", "pop"], "target_valence": 0.7, "target_energy": 0.7, "limit": 5},
-            "neutral": {"seed_genres": ["indie", "alternative", "folk"], "target_valence": 0.5, "target_energy": 0.5, "limit": 5},
-            "disgust": {"seed_genres": ["industrial", "electronic", "rock"], "target_valence": 0.3, "target_energy": 0.6, "limit": 5}
-        }
-        params = emotion_params.get(emotion.lower(), emotion_params["neutral"])
-        seed_genres = ",".join(params["seed_genres"])
-        recommendations = sp.recommendations(
-            seed_genres=seed_genres,
-            target_valence=params["target_valence"],
-            target_energy=params["target_energy"],
-            limit=params["limit"]
-        )
-        songs = []
-        for track in recommendations['tracks']:
-            artists = ", ".join([artist['name'] for artist in track['artists']])
-            song_info = f"{track['name']} - {artists}"
-            song_url = track['external_urls']['spotify']
-            songs.append({'name': song_info, 'url': song_url})
-        return songs
+        return list(fetch_spotify_recommendations(emotion.lower()))
     except Exception as e:
         st.error(f"Error getting Spotify recommendations: {e}")
         return []
 
-def create_audiovisual_experience(background_path, audio_path, emotion):
+def create_audiovisual_experience(background_path, music, emotion):
     try:
         video_clip = ImageClip(background_path)
-        audio_clip = AudioFileClip(audio_path)
+        audio_clip = AudioArrayClip((music / 32767.0)[:, None], fps=SAMPLE_RATE)
         video_clip = video_clip.set_duration(audio_clip.duration)
         final_clip = video_clip.set_audio(audio_clip)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         output_path = f"emotion_experience_{emotion}_{timestamp}.mp4"
-        final_clip.write_videofile(output_path, fps=24)
+        codec, ffmpeg_params = h264_encoder()
+        final_clip.write_videofile(output_path, fps=24, codec=codec, ffmpeg_params=list(ffmpeg_params))
         video_clip.close()
         audio_clip.close()
         return output_path
@@ -158,7 +188,7 @@ def create_audiovisual_experience(background_path, audio_path, emotion):
         return None
 
 def process_media(media_path):
-    music_file = None
+    music = None
     background_path = None
     final_output = None
     try:
@@ -169,9 +199,12 @@ def process_media(media_path):
             img = Image.open(media_path)
             emotion = detect_emotion_from_image(img)
         st.write(f"Detected emotion: {emotion}")
-        music_file = generate_music(emotion)
-        if music_file:
+        music = generate_music(emotion)
+        if music is not None:
             st.write("Playing generated music...")
+            wav_buffer = io.BytesIO()
+            wavfile.write(wav_buffer, SAMPLE_RATE, music)
+            st.audio(wav_buffer.getvalue(), format="audio/wav")
         songs = get_spotify_recommendations(emotion)
         st.write("Spotify Recommendations for your mood:")
         for song in songs:
@@ -185,17 +218,11 @@ def process_media(media_path):
         background_path = f"generated_background_{emotion}_{timestamp}.png"
         background.save(background_path, format="PNG")
         st.write(f"Background saved as: {background_path}")
-        if music_file and background_path:
+        if music is not None and background_path:
             st.write("Creating audiovisual experience...")
-            final_output = create_audiovisual_experience(background_path, music_file, emotion)
+            final_output = create_audiovisual_experience(background_path, music, emotion)
             if final_output:
                 st.write(f"Created audiovisual experience: {final_output}")
-        if music_file and os.path.exists(music_file):
-            try:
-                pygame.mixer.music.stop()
-                os.remove(music_file)
-            except Exception as e:
-                st.error(f"Error cleaning up music file: {e}")
         if background_path and os.path.exists(background_path):
             try:
                 os.remove(background_path)
@@ -204,12 +231,11 @@ def process_media(media_path):
         return emotion, final_output
     except Exception as e:
         st.error(f"Error processing media: {e}")
-        for file_path in [music_file, background_path]:
-            if file_path and os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except:
-                    pass
+        if background_path and os.path.exists(background_path):
+            try:
+                os.remove(background_path)
+            except:
+                pass
         return None, None
 
 def show_emotion_processor():
@@ -220,7 +246,7 @@ def show_emotion_processor():
         temp_dir = tempfile.mkdtemp()
         media_path = os.path.join(temp_dir, uploaded_file.name)
         with open(media_path, "wb") as f:
-            f.write(uploaded_file.read())
+            shutil.copyfileobj(uploaded_file, f, length=1 << 20)
         st.video(media_path) if media_path.lower().endswith(('.mp4', '.avi')) else st.image(media_path)
         if st.button("Process Media"):
             emotion, output_path = process_media(media_path)
@@ -3,7 +3,84 @@ import cv2
 import numpy as np
 import tempfile
 import os
+import queue
+import shutil
+import threading
 from pathlib import Path
+from ffmpeg_utils import open_frame_encoder
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+if njit is not None:
+    @njit(cache=True)
+    def saturate_uint8(value):
+        """Round half to even and clamp a value to the uint8 range, like OpenCV's saturate_cast."""
+        return min(max(np.rint(value), 0.0), 255.0)
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def enhance_kernel(out, src, do_sharpen, alpha_b, beta_b, alpha_c):
+        """Apply sharpening, brightness and contrast to a BGR frame in a single pass over its pixels."""
+        height, width, channels = src.shape
+        for row in prange(height):
+            # prange indices are unsigned; keep the row signed like the border indices around it
+            y = np.int64(row)
+            # Reflect-101 borders, matching cv2.filter2D's default
+            y0 = y - 1 if y > 0 else min(1, height - 1)
+            y1 = y + 1 if y < height - 1 else max(height - 2, 0)
+            for x in range(width):
+                x0 = x - 1 if x > 0 else min(1, width - 1)
+                x1 = x + 1 if x < width - 1 else max(width - 2, 0)
+                for c in range(channels):
+                    value = float(src[y, x, c])
+                    if do_sharpen:
+                        neighbourhood = 0.0
+                        for yy in (y0, y, y1):
+                            for xx in (x0, x, x1):
+                                neighbourhood += src[yy, xx, c]
+                        value = saturate_uint8(10.0 * value - neighbourhood)
+                    value = saturate_uint8(abs(alpha_b * value + beta_b))
+                    value = saturate_uint8(abs(alpha_c * value))
+                    out[y, x, c] = np.uint8(value)
+
+def cuda_available():
+    """Check whether this OpenCV build has CUDA support and can see a GPU."""
+    try:
+        return cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except (AttributeError, cv2.error):
+        return False
+
+def read_frames(vidcap, frame_queue, stop):
+    """
+    Decode frames on a worker thread, ending the stream with None.
+    Frames are decoded into a ring of reused buffers, sized for a full queue plus the
+    frame held by the consumer and the one being decoded, so none is overwritten in use.
+    """
+    buffers = [None] * (frame_queue.maxsize + 2)
+    index = 0
+    while not stop.is_set():
+        success, frame = vidcap.read(buffers[index])
+        if not success:
+            break
+        buffers[index] = frame
+        index = (index + 1) % len(buffers)
+        frame_queue.put(frame)
+    frame_queue.put(None)
+
+def write_frames(out, frame_queue, errors):
+    """Encode frames on a worker thread until None arrives; failures are collected in errors."""
+    while True:
+        frame = frame_queue.get()
+        if frame is None:
+            break
+        if errors:
+            continue  # Keep draining so the main loop never blocks
+        try:
+            out.stdin.write(np.ascontiguousarray(frame).data)
+        except Exception as e:
+            errors.append(e)
 
 def process_video(input_path, enhancement_options):
     """Process video with selected enhancement options"""
@@ -30,84 +107,166 @@ def process_video(input_path, enhancement_options):
     apply_sharpening = "Sharpening" in enhancement_options
     
     try:
-        # Try different codecs in order of preference
-        codecs = [
-            ('mp4v', '.mp4'),
-            ('XVID', '.avi'),
-            ('MJPG', '.avi'),
-            ('DIVX', '.avi')
-        ]
-        
-        out = None
-        for codec, ext in codecs:
-            try:
-                output_path = str(temp_dir / f"enhanced_video{ext}")
-                fourcc = cv2.VideoWriter_fourcc(*codec)
-                out = cv2.VideoWriter(
-                    output_path,
-                    fourcc,
-                    fps,
-                    (frame_width * upscale_factor, frame_height * upscale_factor)
-                )
-                if out.isOpened():
-                    break
-            except:
-                if out is not None:
-                    out.release()
-                continue
-        
-        if out is None or not out.isOpened():
-            raise ValueError("Could not initialize any video codec")
+        # Raw BGR frames are piped into an ffmpeg H.264 encoder
+        out = open_frame_encoder(
+            output_path,
+            frame_width * upscale_factor,
+            frame_height * upscale_factor,
+            fps
+        )
+
+        # Brightness and contrast are folded into the Numba kernel as identity scales when not selected
+        brightness = (1.2, 10.0) if "Brightness" in enhancement_options else (1.0, 0.0)
+        contrast = 1.3 if "Contrast" in enhancement_options else 1.0
+        use_cuda = cuda_available()
+        use_kernel = not use_cuda and njit is not None and (
+            apply_sharpening or "Brightness" in enhancement_options or "Contrast" in enhancement_options
+        )
+        if use_kernel:
+            # Compile (or load the cached build) before the first real frame
+            enhance_kernel(np.empty((3, 3, 3), np.uint8), np.zeros((3, 3, 3), np.uint8), True, 1.0, 0.0, 1.0)
 
-        # Define sharpening kernel
-        sharpening_kernel = np.array([
-            [-1, -1, -1],
-            [-1,  9, -1],
-            [-1, -1, -1]
-        ])
-        
         # Create progress bar
         progress_bar = st.progress(0)
         status_text = st.empty()
         
-        # Process each frame
-        frame_count = 0
-        while True:
-            success, frame = vidcap.read()
-            if not success:
-                break
-                
-            # Update progress
-            progress = int((frame_count / total_frames) * 100)
-            progress_bar.progress(progress)
-            status_text.text(f"Processing frame {frame_count}/{total_frames}")
-            
-            # Apply enhancements
-            processed_frame = frame.copy()  # Make a copy to avoid modifying the original
-            
-            if "Super Resolution" in enhancement_options:
-                processed_frame = cv2.resize(
-                    processed_frame, 
-                    (frame_width * upscale_factor, frame_height * upscale_factor), 
-                    interpolation=cv2.INTER_CUBIC
-                )
-                
-            if apply_sharpening:
-                processed_frame = cv2.filter2D(processed_frame, -1, sharpening_kernel)
-                
-            if "Brightness" in enhancement_options:
-                processed_frame = cv2.convertScaleAbs(processed_frame, alpha=1.2, beta=10)
-                
-            if "Contrast" in enhancement_options:
-                processed_frame = cv2.convertScaleAbs(processed_frame, alpha=1.3, beta=0)
+        # Decode and encode run on worker threads so they overlap with enhancement
+        stop = threading.Event()
+        read_queue = queue.Queue(maxsize=4)
+        write_queue = queue.Queue(maxsize=4)
+        write_errors = []
+        reader = threading.Thread(target=read_frames, args=(vidcap, read_queue, stop), daemon=True)
+        writer = threading.Thread(target=write_frames, args=(out, write_queue, write_errors), daemon=True)
+        reader.start()
+        writer.start()
+        
+        output_size = (frame_height * upscale_factor, frame_width * upscale_factor, 3)
+        if use_kernel or use_cuda:
+            # Reused host buffers: a ring of outputs sized like the reader's
+            output_frames = [np.empty(output_size, np.uint8) for _ in range(write_queue.maxsize + 2)]
+        if use_kernel:
+            resized_frame = np.empty(output_size, np.uint8)
+        if use_cuda:
+            # Device buffers persist across frames; each frame is uploaded and downloaded once
+            stream = cv2.cuda.Stream()
+            gpu_frame = cv2.cuda_GpuMat()
+            gpu_resized = cv2.cuda_GpuMat()
+            gpu_bgra = cv2.cuda_GpuMat()
+            gpu_sharpened = cv2.cuda_GpuMat()
+            gpu_output = cv2.cuda_GpuMat()
+            gpu_adjusted = cv2.cuda_GpuMat()
+            # CUDA linear filters take 1 or 4 channel images, so sharpening runs on BGRA
+            sharpen_filter = cv2.cuda.createLinearFilter(
+                cv2.CV_8UC4, cv2.CV_8UC4,
+                np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]], np.float32)
+            )
+        
+        try:
+            # Process each frame
+            frame_count = 0
+            last_progress = -1
+            while True:
+                frame = read_queue.get()
+                if frame is None:
+                    break
+                    
+                # Update progress at most once per percent; each update is a websocket round trip
+                progress = min(int((frame_count / total_frames) * 100), 100)
+                if progress != last_progress:
+                    progress_bar.progress(progress)
+                    status_text.text(f"Processing frame {frame_count}/{total_frames}")
+                    last_progress = progress
                 
-            # Write the enhanced frame
-            out.write(processed_frame)
-            frame_count += 1
+                # Apply enhancements
+                if use_cuda:
+                    gpu_frame.upload(frame, stream)
+                    processed_gpu = gpu_frame
+                    
+                    if "Super Resolution" in enhancement_options:
+                        processed_gpu = cv2.cuda.resize(
+                            processed_gpu, 
+                            (frame_width * upscale_factor, frame_height * upscale_factor), 
+                            dst=gpu_resized,
+                            interpolation=cv2.INTER_CUBIC,
+                            stream=stream
+                        )
+                        
+                    if apply_sharpening:
+                        cv2.cuda.cvtColor(processed_gpu, cv2.COLOR_BGR2BGRA, dst=gpu_bgra, stream=stream)
+                        sharpen_filter.apply(gpu_bgra, gpu_sharpened, stream)
+                        processed_gpu = cv2.cuda.cvtColor(
+                            gpu_sharpened, cv2.COLOR_BGRA2BGR, dst=gpu_output, stream=stream
+                        )
+                        
+                    # Inputs are non-negative, so a saturating convertTo matches convertScaleAbs; it is safe in place
+                    if "Brightness" in enhancement_options:
+                        processed_gpu = processed_gpu.convertTo(cv2.CV_8U, 1.2, 10.0, stream, gpu_adjusted)
+                        
+                    if "Contrast" in enhancement_options:
+                        processed_gpu = processed_gpu.convertTo(cv2.CV_8U, 1.3, 0.0, stream, gpu_adjusted)
+                    
+                    processed_frame = output_frames[frame_count % len(output_frames)]
+                    processed_gpu.download(stream, processed_frame)
+                    stream.waitForCompletion()
+                elif use_kernel:
+                    source_frame = frame
+                    if "Super Resolution" in enhancement_options:
+                        source_frame = cv2.resize(
+                            frame, 
+                            (frame_width * upscale_factor, frame_height * upscale_factor), 
+                            dst=resized_frame,
+                            interpolation=cv2.INTER_CUBIC
+                        )
+                    processed_frame = output_frames[frame_count % len(output_frames)]
+                    enhance_kernel(processed_frame, source_frame, apply_sharpening, brightness[0], brightness[1], contrast)
+                else:
+                    # Keep the frame in a UMat so every OpenCV step runs on the OpenCL device when one exists;
+                    # intermediate device buffers come from OpenCV's UMat pool
+                    processed_frame = cv2.UMat(frame)
+                    
+                    if "Super Resolution" in enhancement_options:
+                        processed_frame = cv2.resize(
+                            processed_frame, 
+                            (frame_width * upscale_factor, frame_height * upscale_factor), 
+                            interpolation=cv2.INTER_CUBIC
+                        )
+                        
+                    if apply_sharpening:
+                        # The sharpening kernel [[-1,-1,-1],[-1,9,-1],[-1,-1,-1]] equals 10*frame minus the
+                        # unnormalized 3x3 box sum, and the box filter runs as two separable 1D passes
+                        box_sum = cv2.boxFilter(processed_frame, cv2.CV_16S, (3, 3), normalize=False)
+                        processed_frame = cv2.addWeighted(processed_frame, 10.0, box_sum, -1.0, 0.0, dtype=cv2.CV_8U)
+                        
+                    if "Brightness" in enhancement_options:
+                        processed_frame = cv2.convertScaleAbs(processed_frame, alpha=1.2, beta=10)
+                        
+                    if "Contrast" in enhancement_options:
+                        processed_frame = cv2.convertScaleAbs(processed_frame, alpha=1.3, beta=0)
+                    
+                    processed_frame = processed_frame.get()
+                    
+                # Hand the enhanced frame to the writer thread
+                write_queue.put(processed_frame)
+                frame_count += 1
+        finally:
+            stop.set()
+            while reader.is_alive():
+                # Unblock a reader waiting on a full queue
+                try:
+                    read_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            write_queue.put(None)
+            writer.join()
+        
+        if write_errors:
+            raise write_errors[0]
         
         # Release resources
         vidcap.release()
-        out.release()
+        out.stdin.close()
+        if out.wait() != 0:
+            raise ValueError(f"Error encoding video: {out.stderr.read().decode(errors='replace')}")
         
         # Clear progress bar and status
         progress_bar.empty()
@@ -119,7 +278,7 @@ def process_video(input_path, enhancement_options):
         # Clean up resources in case of error
         vidcap.release()
         if 'out' in locals() and out is not None:
-            out.release()
+            out.kill()
         raise e
 
 def show_enhance_video():
@@ -138,7 +297,7 @@ def show_enhance_video():
     if uploaded_file is not None:
         # Save uploaded file temporarily
         tfile = tempfile.NamedTemporaryFile(delete=False, suffix='.mp4')
-        tfile.write(uploaded_file.read())
+        shutil.copyfileobj(uploaded_file, tfile, length=1 << 20)
         tfile.close()  # Close the file immediately after writing
         
         try:
@@ -179,17 +338,18 @@ def show_enhance_video():
                         
                         # Show enhanced video
                         st.markdown("### Enhanced Video")
+                        # Read the output once for both the player and the download button
                         with open(output_path, 'rb') as f:
-                            st.video(f)
+                            video_bytes = f.read()
+                        st.video(video_bytes)
                         
                         # Add download button
-                        with open(output_path, 'rb') as f:
-                            st.download_button(
-                                label="Download Enhanced Video",
-                                data=f.read(),
-                                file_name="enhanced_video.mp4",
-                                mime="video/mp4"
-                            )
+                        st.download_button(
+                            label="Download Enhanced Video",
+                            data=video_bytes,
+                            file_name="enhanced_video.mp4",
+                            mime="video/mp4"
+                        )
                         
                         # Cleanup enhanced video file
                         try:
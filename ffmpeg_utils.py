@@ -0,0 +1,256 @@
+import functools
+import json
+import os
+import subprocess
+from bisect import bisect_left
+
+import numpy as np
+
+# Hardware H.264 encoders in order of preference, with their rate-control settings
+HARDWARE_ENCODERS = [
+    ("h264_nvenc", ("-preset", "p4", "-rc", "vbr", "-cq", "23", "-pix_fmt", "yuv420p")),
+    ("h264_videotoolbox", ("-b:v", "6M", "-pix_fmt", "yuv420p")),
+    ("h264_qsv", ("-global_quality", "23", "-pix_fmt", "nv12")),
+]
+SOFTWARE_ENCODER = ("libx264", ("-preset", "ultrafast", "-tune", "zerolatency", "-pix_fmt", "yuv420p"))
+
+# Codecs that can be stream-copied into an MP4 output; anything else (MJPEG, PCM, Vorbis, Opus) is re-encoded
+MP4_VIDEO_CODECS = {"h264", "hevc", "av1"}
+MP4_AUDIO_CODECS = {"aac", "mp3", "ac3", "eac3", "alac"}
+
+def run_ffmpeg(args, input=None):
+    """Run ffmpeg with the given arguments (and optional stdin text), raising if it fails."""
+    command = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", *args]
+    process = subprocess.run(command, input=input, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {process.stderr}")
+
+@functools.lru_cache(maxsize=None)
+def h264_encoder():
+    """
+    Returns (codec, ffmpeg_params) for the fastest H.264 encoder that works on this machine.
+    Each hardware encoder is probed once with a tiny test encode; libx264 is the fallback.
+    """
+    for codec, params in HARDWARE_ENCODERS:
+        command = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-f", "lavfi", "-i", "color=size=256x256:duration=0.1",
+            "-c:v", codec, *params, "-f", "null", "-"
+        ]
+        try:
+            if subprocess.run(command, capture_output=True).returncode == 0:
+                return codec, params
+        except FileNotFoundError:
+            break
+    return SOFTWARE_ENCODER
+
+def h264_codec_args(software_params=None):
+    """
+    Return the ffmpeg output arguments selecting the preferred H.264 encoder.
+    software_params, when given, replace the default libx264 settings for renders that favour quality.
+    """
+    codec, params = h264_encoder()
+    if software_params is not None and codec == SOFTWARE_ENCODER[0]:
+        params = software_params
+    return ["-c:v", codec, *params]
+
+def open_frame_encoder(output_path, width, height, fps, pix_fmt="bgr24"):
+    """
+    Starts an ffmpeg process that encodes raw frames written to its stdin into an H.264 MP4.
+    Odd dimensions are cropped by one pixel since 4:2:0 chroma needs even sizes.
+    """
+    command = [
+        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+        "-f", "rawvideo", "-vcodec", "rawvideo",
+        "-s", f"{width}x{height}", "-pix_fmt", pix_fmt, "-r", str(fps),
+        "-i", "-",
+        "-vf", "crop=trunc(iw/2)*2:trunc(ih/2)*2",
+        *h264_codec_args(),
+        "-movflags", "+faststart",
+        output_path
+    ]
+    return subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+def open_frame_decoder(input_path, width, height, pix_fmt="gray"):
+    """
+    Starts an ffmpeg process that decodes a video, on a hardware decoder when one is available,
+    and writes its frames to stdout as raw width x height images in pix_fmt.
+    """
+    command = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-hwaccel", "auto", "-i", input_path,
+        "-an", "-vf", f"scale={width}:{height}:flags=area",
+        "-f", "rawvideo", "-pix_fmt", pix_fmt,
+        "pipe:1"
+    ]
+    return subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=1 << 20)
+
+def decode_audio(path, sample_rate):
+    """Decode the audio track of a media file into a mono float32 array at sample_rate."""
+    command = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-i", path, "-vn", "-ac", "1", "-ar", str(sample_rate),
+        "-f", "f32le", "pipe:1"
+    ]
+    process = subprocess.run(command, capture_output=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {process.stderr.decode(errors='replace')}")
+    return np.frombuffer(process.stdout, dtype=np.float32)
+
+def run_ffprobe(args):
+    """Run ffprobe with the given arguments and return its standard output."""
+    command = ["ffprobe", "-v", "error", *args]
+    process = subprocess.run(command, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {process.stderr}")
+    return process.stdout
+
+def probe_duration(path):
+    """Return the container duration of a media file in seconds."""
+    output = run_ffprobe([
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        path
+    ])
+    return float(output.strip())
+
+def probe_frame_rate(path):
+    """Return the frame rate of the first video stream in frames per second."""
+    output = run_ffprobe([
+        "-select_streams", "v:0",
+        "-show_entries", "stream=r_frame_rate",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        path
+    ])
+    numerator, _, denominator = output.strip().partition("/")
+    return float(numerator) / float(denominator or 1)
+
+def probe_video_codec(path):
+    """Return the codec name of the first video stream, e.g. "h264"."""
+    output = run_ffprobe([
+        "-select_streams", "v:0",
+        "-show_entries", "stream=codec_name",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        path
+    ])
+    return output.strip()
+
+def probe_audio_codec(path):
+    """Return the codec name of the first audio stream, or an empty string when there is none."""
+    output = run_ffprobe([
+        "-select_streams", "a:0",
+        "-show_entries", "stream=codec_name",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        path
+    ])
+    return output.strip()
+
+def probe_frame_size(path):
+    """
+    Return the displayed (width, height) of the first video stream.
+    ffmpeg auto-rotates decoded frames, so a stream rotated by 90 degrees reports its coded size swapped.
+    """
+    output = run_ffprobe([
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height:stream_tags=rotate:stream_side_data=rotation",
+        "-of", "json",
+        path
+    ])
+    stream = json.loads(output)["streams"][0]
+    # Older ffmpeg reports the rotation as a stream tag, newer versions as display matrix side data
+    rotation = stream.get("tags", {}).get("rotate") or next(
+        (side_data["rotation"] for side_data in stream.get("side_data_list", []) if "rotation" in side_data), 0
+    )
+    width, height = stream["width"], stream["height"]
+    if abs(int(float(rotation))) % 180 == 90:
+        width, height = height, width
+    return width, height
+
+def stream_signature(path):
+    """
+    Return the per-stream codec parameters that must match for files to be joined by stream copy.
+    The profile and a hash of the codec extradata (e.g. H.264 SPS/PPS) are included, since streams
+    that differ in those can't be spliced even when the codec and frame size match.
+    """
+    output = run_ffprobe([
+        "-show_data_hash", "CRC32",
+        "-show_entries",
+        "stream=codec_type,codec_name,profile,extradata_hash,width,height,pix_fmt,r_frame_rate,sample_rate,channels",
+        "-of", "json",
+        path
+    ])
+    return tuple(
+        tuple(stream.get(key) for key in (
+            "codec_type", "codec_name", "profile", "extradata_hash",
+            "width", "height", "pix_fmt", "r_frame_rate", "sample_rate", "channels"
+        ))
+        for stream in json.loads(output).get("streams", [])
+    )
+
+def has_audio(path):
+    """Check whether a media file has an audio stream."""
+    return any(stream[0] == "audio" for stream in stream_signature(path))
+
+def mp4_compatible(path):
+    """Check whether every video and audio stream of a file can be copied into an MP4 container."""
+    for codec_type, codec_name, *_ in stream_signature(path):
+        if codec_type == "video" and codec_name not in MP4_VIDEO_CODECS:
+            return False
+        if codec_type == "audio" and codec_name not in MP4_AUDIO_CODECS:
+            return False
+    return True
+
+def can_concat_copy(paths):
+    """Check whether the files share codecs and stream layout, so the concat demuxer can copy them."""
+    return len({stream_signature(path) for path in paths}) == 1
+
+def keyframe_times(path):
+    """Return the sorted keyframe timestamps of the first video stream (read from packet flags, no decoding)."""
+    output = run_ffprobe([
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=p=0",
+        path
+    ])
+    times = []
+    for line in output.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            times.append(float(pts_time))
+    return sorted(times)
+
+def on_keyframes(path, times, tolerance=0.05):
+    """Check whether every timestamp in times falls within tolerance seconds of a keyframe."""
+    keyframes = keyframe_times(path)
+    if not keyframes:
+        return False
+    for time in times:
+        i = bisect_left(keyframes, time)
+        nearest = min(abs(keyframes[j] - time) for j in (i - 1, i) if 0 <= j < len(keyframes))
+        if nearest > tolerance:
+            return False
+    return True
+
+def concat_script(segments):
+    """Build a concat demuxer script for (path, inpoint, outpoint) segments; inpoint/outpoint may be None."""
+    lines = []
+    for path, inpoint, outpoint in segments:
+        escaped = os.path.abspath(path).replace("'", "'\\''")
+        # An explicit file: URL, since a script read from pipe:0 would otherwise resolve paths as pipe:/...
+        lines.append(f"file 'file:{escaped}'")
+        if inpoint is not None:
+            lines.append(f"inpoint {inpoint:.3f}")
+        if outpoint is not None:
+            lines.append(f"outpoint {outpoint:.3f}")
+    return "\n".join(lines) + "\n"
+
+def concat_segments(segments, output_path, codec_args=None):
+    """
+    Joins (path, inpoint, outpoint) segments into one file with the ffmpeg concat demuxer.
+    The script is fed to ffmpeg over stdin, and streams are copied unless codec_args are given.
+    """
+    run_ffmpeg([
+        "-f", "concat", "-safe", "0", "-protocol_whitelist", "file,pipe", "-i", "pipe:0",
+        *(codec_args or ["-c", "copy"]),
+        output_path
+    ], input=concat_script(segments))
@@ -1,12 +1,33 @@
 import cv2
 import os
 import numpy as np
+from scipy.ndimage import uniform_filter1d
 import streamlit as st
-from moviepy.editor import VideoFileClip
 from pydub import AudioSegment
 from pydub.silence import detect_nonsilent
 import tempfile
 import shutil
+from ffmpeg_utils import h264_codec_args, on_keyframes, open_frame_decoder, probe_duration, probe_frame_rate, run_ffmpeg
+
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        """Stand-in for numba.njit when Numba is not installed; the function runs as plain Python."""
+        return lambda func: func
+
+# Frame size used for scene-change detection; the difference score doesn't need full resolution
+SCENE_SIZE = (320, 180)
+
+@njit(cache=True)
+def score_frames(ranges, diffs, total_frames):
+    """Score each frame by the nonsilent (start, end) frame ranges covering it plus its scene difference."""
+    scores = np.zeros(total_frames, dtype=np.float32)
+    for k in range(ranges.shape[0]):
+        scores[ranges[k, 0]:ranges[k, 1]] += 1.0
+    count = min(diffs.shape[0], total_frames)
+    scores[:count] += diffs[:count]
+    return scores
 
 def extract_highlight(video_path, highlight_duration):
     """
@@ -16,20 +37,25 @@ def extract_highlight(video_path, highlight_duration):
         raise FileNotFoundError(f"The file '{video_path}' does not exist.")
 
     try:
-        video = VideoFileClip(video_path)
+        duration = probe_duration(video_path)
+        fps = int(probe_frame_rate(video_path))
     except Exception as e:
         raise ValueError(f"Could not process video file: {e}")
 
     # Adjust highlight duration if video is too short
-    if video.duration < highlight_duration:
-        st.warning(f"Requested highlight duration ({highlight_duration}s) exceeds video duration ({video.duration}s).")
-        highlight_duration = video.duration
+    if duration < highlight_duration:
+        st.warning(f"Requested highlight duration ({highlight_duration}s) exceeds video duration ({duration}s).")
+        highlight_duration = duration
         st.warning(f"Highlight duration adjusted to {highlight_duration:.2f} seconds.")
 
-    # Extract audio and analyze nonsilent parts
+    # Extract audio and analyze nonsilent parts; mono 8 kHz is plenty for silence detection
     with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_audio_file:
         audio_path = temp_audio_file.name
-        video.audio.write_audiofile(audio_path)
+    try:
+        run_ffmpeg(["-i", video_path, "-vn", "-ac", "1", "-ar", "8000", "-f", "wav", audio_path])
+    except RuntimeError as e:
+        os.remove(audio_path)
+        raise ValueError(f"Could not extract audio from video: {e}")
 
     audio = AudioSegment.from_file(audio_path, format="wav")
     silence_thresh = audio.dBFS - 10  # Dynamic silence threshold
@@ -39,45 +65,40 @@ def extract_highlight(video_path, highlight_duration):
         os.remove(audio_path)
         raise ValueError("No significant audio activity detected in the video.")
 
-    fps = int(video.fps)
-    total_frames = int(video.duration * fps)
+    total_frames = int(duration * fps)
     nonsilent_ranges_frames = [(int(start / 1000 * fps), int(end / 1000 * fps)) for start, end in nonsilent_ranges]
 
-    # Analyze scene changes
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        os.remove(audio_path)
-        raise ValueError(f"Unable to open video file: {video_path}")
-
-    frame_diffs = []
-    prev_frame = None
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
+    # Analyze scene changes on small grayscale frames decoded (and scaled) by ffmpeg;
+    # each frame is read into one of two reused buffers
+    decoder = open_frame_decoder(video_path, *SCENE_SIZE, pix_fmt="gray")
+    frame_bytes = SCENE_SIZE[0] * SCENE_SIZE[1]
+    prev_frame = np.empty((SCENE_SIZE[1], SCENE_SIZE[0]), dtype=np.uint8)
+    gray_frame = np.empty_like(prev_frame)
+    frame_diffs = np.empty(total_frames, dtype=np.float32)
+    diff_count = 0
 
-        gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        if prev_frame is not None:
-            diff = cv2.absdiff(gray_frame, prev_frame)
-            frame_diffs.append(np.sum(diff))
-        prev_frame = gray_frame
+    try:
+        if decoder.stdout.readinto(prev_frame) == frame_bytes:
+            while diff_count < total_frames and decoder.stdout.readinto(gray_frame) == frame_bytes:
+                # L1 norm of the difference: absdiff and sum fused into one pass, with no diff image
+                frame_diffs[diff_count] = cv2.norm(gray_frame, prev_frame, cv2.NORM_L1)
+                diff_count += 1
+                prev_frame, gray_frame = gray_frame, prev_frame
+    finally:
+        decoder.stdout.close()
+        decoder.kill()
+        decoder.wait()
 
-    cap.release()
-    frame_diffs = frame_diffs[:total_frames]
+    frame_diffs = frame_diffs[:diff_count]
 
-    if not frame_diffs:
+    if not diff_count:
         os.remove(audio_path)
         raise ValueError("No significant scene changes detected in the video.")
 
     # Combine scores
-    frame_scores = np.zeros(total_frames)
-    for start, end in nonsilent_ranges_frames:
-        frame_scores[start:end] += 1
-
-    for i, diff in enumerate(frame_diffs):
-        if i < len(frame_scores):  # Ensure index is within bounds
-            frame_scores[i] += diff
+    frame_scores = score_frames(
+        np.asarray(nonsilent_ranges_frames, dtype=np.int64).reshape(-1, 2), frame_diffs, total_frames
+    )
 
     # Adjust highlight duration
     highlight_frames = int(highlight_duration * fps)
@@ -86,16 +107,28 @@ def extract_highlight(video_path, highlight_duration):
         st.warning(f"Highlight duration adjusted to {highlight_duration:.2f} seconds.")
 
     highlight_frames = int(highlight_duration * fps)
-    start_frame = np.argmax(
-        [np.sum(frame_scores[i:i + highlight_frames]) for i in range(len(frame_scores) - highlight_frames)]
+    # Sliding window means in one pass; the origin shift makes entry i cover frames [i, i + W)
+    window_means = uniform_filter1d(
+        frame_scores, size=highlight_frames, mode="constant", origin=-(highlight_frames // 2)
     )
+    start_frame = int(np.argmax(window_means[:len(frame_scores) - highlight_frames + 1]))
     end_frame = start_frame + highlight_frames
 
     # Extract and save the highlight
     output_path = os.path.join(tempfile.gettempdir(), "highlight.mp4")
     try:
-        highlight_clip = video.subclip(start_frame / fps, end_frame / fps)
-        highlight_clip.write_videofile(output_path, codec="libx264", audio_codec="aac")
+        # Copy the packets when the highlight starts on a keyframe, otherwise re-encode for a frame-accurate cut
+        start_time = start_frame / fps
+        if on_keyframes(video_path, [start_time]):
+            codec_args = ["-c", "copy", "-avoid_negative_ts", "make_zero"]
+        else:
+            codec_args = [*h264_codec_args(), "-c:a", "aac"]
+        run_ffmpeg([
+            "-ss", f"{start_time:.3f}", "-i", video_path,
+            "-t", f"{(end_frame - start_frame) / fps:.3f}",
+            *codec_args, "-movflags", "+faststart",
+            output_path
+        ])
     finally:
         os.remove(audio_path)  # Clean up temporary file
 
@@ -110,7 +143,7 @@ def show_highlight_extractor():
         temp_dir = tempfile.mkdtemp()
         video_path = os.path.join(temp_dir, uploaded_file.name)
         with open(video_path, "wb") as f:
-            f.write(uploaded_file.read())
+            shutil.copyfileobj(uploaded_file, f, length=1 << 20)
 
         st.video(video_path)
 
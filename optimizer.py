@@ -4,6 +4,41 @@ import streamlit as st
 from typing import Tuple
 import tempfile
 import shutil
+from ffmpeg_utils import SOFTWARE_ENCODER, h264_encoder
+
+def optimize_commands(input_path: str, output_path: str, width: int, height: int):
+    """
+    Returns the ffmpeg commands to try, fastest first, for scaling and re-encoding a video.
+    With NVENC the frames stay in GPU memory from decode through scale_cuda to encode.
+    """
+    audio_args = ["-c:a", "aac", "-b:a", "128k", output_path]
+    codec, params = h264_encoder()
+    software_command = [
+        "ffmpeg", "-y", "-i", input_path,
+        "-vf", f"scale={width}:{height}",
+        "-c:v", "libx264", "-crf", "23", "-preset", "veryfast",
+        *audio_args
+    ]
+    if codec == SOFTWARE_ENCODER[0]:
+        return [software_command]
+
+    hardware_command = [
+        "ffmpeg", "-y", "-i", input_path,
+        "-vf", f"scale={width}:{height}",
+        "-c:v", codec, *params,
+        *audio_args
+    ]
+    if codec != "h264_nvenc":
+        return [hardware_command, software_command]
+
+    cuda_command = [
+        "ffmpeg", "-y", "-hwaccel", "cuda", "-hwaccel_output_format", "cuda", "-i", input_path,
+        "-vf", f"scale_cuda={width}:{height}",
+        "-c:v", "h264_nvenc", "-preset", "p4", "-rc", "vbr", "-cq", "23",
+        *audio_args
+    ]
+    # Inputs NVDEC can't decode fall back to a CPU scale feeding NVENC
+    return [cuda_command, hardware_command, software_command]
 
 def optimize_video(input_path: str, output_path: str, resolution: Tuple[int, int], platform: str):
     """
@@ -14,24 +49,17 @@ def optimize_video(input_path: str, output_path: str, resolution: Tuple[int, int
     # Create output directory if it doesn't exist
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
-    # Command to optimize video using ffmpeg
-    command = [
-        "ffmpeg",
-        "-i", input_path,
-        "-vf", f"scale={width}:{height}",
-        "-c:v", "libx264",
-        "-crf", "23",
-        "-preset", "medium",
-        "-c:a", "aac",
-        "-b:a", "128k",
-        output_path
-    ]
+    # Commands to optimize video using ffmpeg, from the fastest encoder path to plain libx264
+    commands = optimize_commands(input_path, output_path, width, height)
 
-    try:
-        subprocess.run(command, check=True)
-        st.success(f"Video optimized for {platform} and saved to {output_path}")
-    except subprocess.CalledProcessError as e:
-        st.error(f"Error optimizing video: {e}")
+    for i, command in enumerate(commands):
+        try:
+            subprocess.run(command, check=True)
+            st.success(f"Video optimized for {platform} and saved to {output_path}")
+            return
+        except subprocess.CalledProcessError as e:
+            if i == len(commands) - 1:
+                st.error(f"Error optimizing video: {e}")
 
 def get_platform_resolution(platform: str) -> Tuple[int, int]:
     """
@@ -54,7 +82,7 @@ def show_video_optimizer():
         temp_dir = tempfile.mkdtemp()
         input_path = os.path.join(temp_dir, uploaded_file.name)
         with open(input_path, "wb") as f:
-            f.write(uploaded_file.read())
+            shutil.copyfileobj(uploaded_file, f, length=1 << 20)
 
         st.video(input_path)
 
@@ -65,16 +93,17 @@ def show_video_optimizer():
             optimize_video(input_path, output_path, resolution, platform)
 
             st.write("### Optimized Video")
+            # Read the output once and hand the same bytes to the player and the download button
             with open(output_path, "rb") as f:
-                st.video(f)
+                video_bytes = f.read()
+            st.video(video_bytes)
 
-            with open(output_path, "rb") as f:
-                st.download_button(
-                    label="Download Optimized Video",
-                    data=f.read(),
-                    file_name=f"{platform.lower()}_optimized.mp4",
-                    mime="video/mp4"
-                )
+            st.download_button(
+                label="Download Optimized Video",
+                data=video_bytes,
+                file_name=f"{platform.lower()}_optimized.mp4",
+                mime="video/mp4"
+            )
 
         # Cleanup temporary files
         os.remove(input_path)
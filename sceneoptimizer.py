@@ -1,42 +1,84 @@
 import os
+import shutil
 import streamlit as st
-import librosa
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from scenedetect import open_video, SceneManager
 from scenedetect.detectors import ContentDetector
 from moviepy.editor import VideoFileClip, concatenate_videoclips
+from ffmpeg_utils import (
+    can_concat_copy, concat_segments, decode_audio, h264_codec_args, mp4_compatible, probe_duration, run_ffmpeg
+)
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+# Audio is decoded once per video at this rate, and scene loudness is measured over RMS windows of this many samples
+AUDIO_SAMPLE_RATE = 16000
+RMS_WINDOW = 1024
 
 # Function to detect scenes
 def detect_scenes(video_path, threshold=5.0):
     video = open_video(video_path)
     scene_manager = SceneManager()
     scene_manager.add_detector(ContentDetector(threshold=threshold))
-    scene_manager.detect_scenes(video)
+    # Analyze roughly 320px-wide frames and every third frame; cuts need neither full resolution nor every frame
+    scene_manager.auto_downscale = False
+    scene_manager.downscale = max(video.frame_size[0] // 320, 1)
+    scene_manager.detect_scenes(video=video, frame_skip=2)
     scene_list = scene_manager.get_scene_list()
     return [(scene[0].get_seconds(), scene[1].get_seconds()) for scene in scene_list]
 
 # Function to determine if a scene is mostly silent
-def is_scene_silent(audio_path, silence_threshold=-35.0):
+def is_scene_silent(audio, sample_rate, start_time, end_time, silence_threshold=-35.0):
     """
     Determines if a scene's audio is mostly silent based on the root mean square (RMS) energy.
 
     Parameters:
-        audio_path (str): Path to the audio file extracted from the scene.
+        audio (np.ndarray): Mono float32 audio of the whole video.
+        sample_rate (int): Sample rate of the audio.
+        start_time (float): Start of the scene in seconds.
+        end_time (float): End of the scene in seconds.
         silence_threshold (float): The threshold in decibels below which audio is considered silent. Default is -35 dB.
 
     Returns:
         bool: True if more than 90% of the audio is below the silence threshold, False otherwise.
     """
-    y, sr = librosa.load(audio_path, sr=None)
-    energy = librosa.feature.rms(y=y)[0]
-    db_energy = librosa.amplitude_to_db(energy)
+    chunk = audio[int(start_time * sample_rate):int(end_time * sample_rate)]
+    if chunk.size == 0:
+        return True  # Scenes without audio are treated as silent
+    windows = chunk[:max(chunk.size // RMS_WINDOW, 1) * RMS_WINDOW].reshape(-1, min(RMS_WINDOW, chunk.size))
+    energy = np.sqrt(np.mean(windows * windows, axis=1))
+    db_energy = 20 * np.log10(np.maximum(energy, 1e-5))
     silent_portion = np.sum(db_energy < silence_threshold) / len(db_energy)
     return silent_portion > 0.9  # 90% silence threshold
 
-# Function to extract audio from a scene
-def extract_audio(scene_clip, output_audio_path):
-    if scene_clip.audio is not None:
-        scene_clip.audio.write_audiofile(output_audio_path, codec="pcm_s16le", verbose=False, logger=None)
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def silent_mask(audio, sample_rate, start_times, end_times, silence_threshold):
+        """is_scene_silent for every scene at once, with scenes scanned in parallel; returns a boolean mask."""
+        # Compare mean squares with the threshold as a power ratio instead of taking a log per window
+        power_threshold = 10.0 ** (silence_threshold / 10.0)
+        mask = np.empty(start_times.size, np.bool_)
+        for i in prange(start_times.size):
+            start = min(int(start_times[i] * sample_rate), audio.size)
+            end = min(int(end_times[i] * sample_rate), audio.size)
+            if end <= start:
+                mask[i] = True
+                continue
+            window = min(RMS_WINDOW, end - start)
+            window_count = max((end - start) // RMS_WINDOW, 1)
+            silent_windows = 0
+            for w in range(window_count):
+                total = 0.0
+                for k in range(start + w * window, start + (w + 1) * window):
+                    total += audio[k] * audio[k]
+                if max(total / window, 1e-10) < power_threshold:
+                    silent_windows += 1
+            mask[i] = silent_windows / window_count > 0.9
+        return mask
 
 # Function to remove repeated files based on duration similarity
 def remove_repeated_files(video_paths, min_duration=4.0):
@@ -53,11 +95,13 @@ def remove_repeated_files(video_paths, min_duration=4.0):
     filtered_paths = []
     previous_duration = None
 
-    for video_path in video_paths:
+    # Probe every file concurrently; each probe waits on its own ffprobe process
+    with ThreadPoolExecutor() as executor:
+        durations = [executor.submit(probe_duration, video_path) for video_path in video_paths]
+
+    for video_path, duration in zip(video_paths, durations):
         try:
-            video_clip = VideoFileClip(video_path)
-            current_duration = video_clip.duration
-            video_clip.close()
+            current_duration = duration.result()
 
             # Check if the video content repeats and remove if necessary
             if previous_duration is None or abs(current_duration - previous_duration) > min_duration:
@@ -70,40 +114,72 @@ def remove_repeated_files(video_paths, min_duration=4.0):
 
     return filtered_paths
 
+# Function to save an uploaded file to disk
+def save_upload(uploaded_file, video_path):
+    with open(video_path, "wb") as f:
+        shutil.copyfileobj(uploaded_file, f, length=1 << 20)
+
 # Function to concatenate uploaded videos
 def concatenate_videos(video_paths, output_path):
+    # Files with matching, MP4-compatible codecs and stream layout are joined by the concat demuxer without re-encoding
+    if can_concat_copy(video_paths) and mp4_compatible(video_paths[0]):
+        concat_segments([(video_path, None, None) for video_path in video_paths], output_path)
+        return
+
     clips = [VideoFileClip(video_path) for video_path in video_paths]
-    final_clip = concatenate_videoclips(clips, method="compose")
-    final_clip.write_videofile(output_path, codec="libx264", fps=24)
-    for clip in clips:
-        clip.close()
+    try:
+        final_clip = concatenate_videoclips(clips, method="compose")
+        final_clip.write_videofile(output_path, codec="libx264", fps=24)
+    finally:
+        for clip in clips:
+            clip.close()
+
+# Function to build an ffmpeg filter graph that cuts scenes out of one input and joins them
+def scene_filter_graph(scenes):
+    filters = []
+    outputs = []
+    for i, (start_time, end_time) in enumerate(scenes):
+        filters.append(f"[0:v]trim=start={start_time:.3f}:end={end_time:.3f},setpts=PTS-STARTPTS[v{i}]")
+        filters.append(f"[0:a]atrim=start={start_time:.3f}:end={end_time:.3f},asetpts=PTS-STARTPTS[a{i}]")
+        outputs.append(f"[v{i}][a{i}]")
+    filters.append(f"{''.join(outputs)}concat=n={len(scenes)}:v=1:a=1[vout][aout]")
+    return ";".join(filters)
 
 # Main video processing function
 def process_video(input_video_path, output_video_path, threshold, silence_threshold):
     scenes = detect_scenes(input_video_path, threshold=threshold)
-    processed_clips = []
 
-    video_clip = VideoFileClip(input_video_path)
+    # Decode the audio track once and measure every scene on the in-memory samples
     try:
-        for i, (start_time, end_time) in enumerate(scenes):
-            scene_clip = video_clip.subclip(start_time, end_time)
-            scene_audio_path = f"temp_scene_{i+1}.wav"
-
-            extract_audio(scene_clip, scene_audio_path)
-            if os.path.exists(scene_audio_path) and not is_scene_silent(scene_audio_path, silence_threshold=silence_threshold):
-                processed_clips.append(scene_clip)
-
-            if os.path.exists(scene_audio_path):
-                os.remove(scene_audio_path)
-
-        if processed_clips:
-            final_clip = concatenate_videoclips(processed_clips, method="compose")
-            final_clip.write_videofile(output_video_path, codec="libx264", fps=24)
-            final_clip.close()
-        else:
-            st.error("No relevant scenes found. No output video generated.")
-    finally:
-        video_clip.close()
+        audio = decode_audio(input_video_path, AUDIO_SAMPLE_RATE)
+    except RuntimeError:
+        audio = np.empty(0, dtype=np.float32)  # No audio track: every scene counts as silent
+
+    if njit is not None and scenes:
+        silent = silent_mask(
+            audio, AUDIO_SAMPLE_RATE,
+            np.array([start for start, _ in scenes]), np.array([end for _, end in scenes]),
+            silence_threshold
+        )
+    else:
+        silent = [
+            is_scene_silent(audio, AUDIO_SAMPLE_RATE, start_time, end_time, silence_threshold=silence_threshold)
+            for start_time, end_time in scenes
+        ]
+
+    kept_scenes = [scene for scene, scene_silent in zip(scenes, silent) if not scene_silent]
+
+    if kept_scenes:
+        # Cut and join the kept scenes in one ffmpeg graph: a single decode and a single encode
+        run_ffmpeg([
+            "-i", input_video_path,
+            "-filter_complex", scene_filter_graph(kept_scenes),
+            "-map", "[vout]", "-map", "[aout]",
+            *h264_codec_args(), "-c:a", "aac",
+            output_video_path
+        ])
+    else:
+        st.error("No relevant scenes found. No output video generated.")
 
 # Streamlit UI
 def show_sceneoptimizer():
@@ -130,14 +206,11 @@ def show_sceneoptimizer():
 
         if st.button("Process Videos"):
             with st.spinner("Processing videos..."):
-                video_paths = []
+                video_paths = [f"input_{uploaded_file.name}" for uploaded_file in uploaded_files]
 
-                # Save uploaded videos to disk
-                for uploaded_file in uploaded_files:
-                    video_path = f"input_{uploaded_file.name}"
-                    with open(video_path, "wb") as f:
-                        f.write(uploaded_file.read())
-                    video_paths.append(video_path)
+                # Save uploaded videos to disk in parallel
+                with ThreadPoolExecutor() as executor:
+                    list(executor.map(save_upload, uploaded_files, video_paths))
 
                 # Remove repetitive video files based on duration
                 filtered_video_paths = remove_repeated_files(video_paths, min_duration=4.0)
@@ -155,6 +228,8 @@ def show_sceneoptimizer():
                     # Display the processed video
                     st.success("Processing complete! Download your video below.")
                     st.video(output_video_path)
+                except RuntimeError as e:
+                    st.error(f"Error processing videos: {e}")
                 finally:
                     # Clean up temporary files
                     for video_path in video_paths:
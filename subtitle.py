@@ -1,11 +1,13 @@
 import streamlit as st
 import os
+import shutil
 import subprocess
 from datetime import timedelta
 try:
-    import whisper
+    import ctranslate2
+    from faster_whisper import WhisperModel
 except ImportError:
-    st.error("Please install whisper using: pip install git+https://github.com/openai/whisper.git")
+    st.error("Please install faster-whisper using: pip install faster-whisper")
     st.stop()
 
 try:
@@ -76,11 +78,19 @@ def extract_audio(video_path, output_audio_path):
     if process.returncode != 0:
         raise Exception(f"Error extracting audio: {process.stderr}")
 
+@st.cache_resource
+def get_whisper_model(model_name='medium'):
+    """Load a faster-whisper (CTranslate2) model once per process, in FP16 on the GPU or int8 on the CPU"""
+    if ctranslate2.get_cuda_device_count() > 0:
+        return WhisperModel(model_name, device='cuda', compute_type='float16')
+    return WhisperModel(model_name, device='cpu', compute_type='int8')
+
 def transcribe_audio_to_english_segments(audio_path, source_language, model_name='medium'):
     """Transcribe audio to English segments using Whisper"""
-    model = whisper.load_model(model_name)
-    result = model.transcribe(audio_path, language=source_language, task='translate')
-    return result['segments']
+    model = get_whisper_model(model_name)
+    # Voice activity detection skips silent stretches before they reach the decoder
+    segments, _ = model.transcribe(audio_path, language=source_language, task='translate', vad_filter=True)
+    return [{'start': segment.start, 'end': segment.end, 'text': segment.text} for segment in segments]
 
 def format_timedelta_to_srt_time(td):
     """Convert timedelta to SRT time format"""
@@ -186,23 +196,11 @@ def show_subtitle():
                 if uploaded_file.type not in ['video/mp4', 'video/quicktime', 'video/x-msvideo', 'video/webm']:
                     st.error("⚠️ Please upload a supported video format.")
                     st.stop()
-            
-            if uploaded_file:
-                # Show upload progress
-                progress_text = "Uploading video..."
-                progress_bar = st.progress(0)
-                
-                for i in range(100):
-                    # Simulating upload progress
-                    progress_bar.progress(i + 1)
-                    if i == 99:
-                        progress_text = "Upload complete!"
-                progress_bar.empty()
     
     if uploaded_file is not None:
         # Save uploaded file temporarily
         tfile = tempfile.NamedTemporaryFile(delete=False, suffix='.mp4')
-        tfile.write(uploaded_file.read())
+        shutil.copyfileobj(uploaded_file, tfile, length=1 << 20)
         tfile.close()
         
         try:
@@ -248,20 +246,21 @@ def show_subtitle():
                     
                     # Show video with subtitles
                     st.markdown("### Video with Subtitles")
+                    # Read the output once for both the player and the download button
                     with open(output_path, 'rb') as f:
-                        st.video(f)
+                        video_bytes = f.read()
+                    st.video(video_bytes)
                     
                     # Add download buttons
                     col3, col4 = st.columns(2)
                     
                     with col3:
-                        with open(output_path, 'rb') as f:
-                            st.download_button(
-                                label="Download Video with Subtitles",
-                                data=f.read(),
-                                file_name="video_with_subtitles.mp4",
-                                mime="video/mp4"
-                            )
+                        st.download_button(
+                            label="Download Video with Subtitles",
+                            data=video_bytes,
+                            file_name="video_with_subtitles.mp4",
+                            mime="video/mp4"
+                        )
                     
                     with col4:
                         with open(srt_path, 'rb') as f:
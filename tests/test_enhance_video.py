@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("numba")
+pytest.importorskip("streamlit")
+
+import enhance_video  # noqa: E402
+
+SHARPEN_KERNEL = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]], np.float32)
+
+def run_kernel(frame, do_sharpen, brightness, contrast):
+    """Run the jitted enhancement kernel into a fresh output frame."""
+    out = np.empty_like(frame)
+    enhance_video.enhance_kernel(out, frame, do_sharpen, brightness[0], brightness[1], contrast)
+    return out
+
+def test_kernel_matches_opencv_sharpen_brightness_contrast():
+    frame = np.random.default_rng(0).integers(0, 256, (37, 53, 3), dtype=np.uint8)
+    expected = cv2.filter2D(frame, -1, SHARPEN_KERNEL)
+    expected = cv2.convertScaleAbs(expected, alpha=1.2, beta=10)
+    expected = cv2.convertScaleAbs(expected, alpha=1.3, beta=0)
+    np.testing.assert_array_equal(run_kernel(frame, True, (1.2, 10.0), 1.3), expected)
+
+def test_kernel_rounds_like_convert_scale_abs():
+    # Every uint8 value, so results that land on .5 are covered
+    frame = np.repeat(np.arange(256, dtype=np.uint8), 3).reshape(16, 16, 3)
+    expected = cv2.convertScaleAbs(frame, alpha=1.2, beta=10)
+    np.testing.assert_array_equal(run_kernel(frame, False, (1.2, 10.0), 1.0), expected)
+    expected = cv2.convertScaleAbs(frame, alpha=1.3, beta=0)
+    np.testing.assert_array_equal(run_kernel(frame, False, (1.0, 0.0), 1.3), expected)
@@ -0,0 +1,31 @@
+import shutil
+
+import pytest
+
+if shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None:
+    pytest.skip("ffmpeg is not installed", allow_module_level=True)
+
+from ffmpeg_utils import concat_segments, probe_duration, run_ffmpeg  # noqa: E402
+
+def make_video(path, duration):
+    """Write a short test pattern with a tone."""
+    run_ffmpeg([
+        "-f", "lavfi", "-i", f"testsrc=size=160x120:rate=25:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={duration}",
+        "-c:v", "mpeg4", "-g", "25", "-c:a", "aac",
+        str(path)
+    ])
+    return str(path)
+
+def test_concat_segments_copies_whole_files(tmp_path):
+    # A quote in the name exercises the script escaping
+    paths = [make_video(tmp_path / "first.mp4", 2), make_video(tmp_path / "it's second.mp4", 3)]
+    output_path = str(tmp_path / "joined.mp4")
+    concat_segments([(path, None, None) for path in paths], output_path)
+    assert probe_duration(output_path) == pytest.approx(5, abs=0.2)
+
+def test_concat_segments_reencodes_segments(tmp_path):
+    path = make_video(tmp_path / "input.mp4", 4)
+    output_path = str(tmp_path / "joined.mp4")
+    concat_segments([(path, 0, 1), (path, 2, 4)], output_path, ["-c:v", "mpeg4", "-c:a", "aac"])
+    assert probe_duration(output_path) == pytest.approx(3, abs=0.2)
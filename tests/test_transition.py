@@ -0,0 +1,50 @@
+import shutil
+
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("moviepy.editor")
+if shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None:
+    pytest.skip("ffmpeg is not installed", allow_module_level=True)
+
+import transition  # noqa: E402
+from ffmpeg_utils import h264_codec_args, probe_duration, run_ffmpeg  # noqa: E402
+
+SIZE = (320, 240)
+
+def make_video(path, duration):
+    """Write a test pattern with a tone, normalized like an upload."""
+    source_path = str(path) + ".mkv"
+    run_ffmpeg([
+        "-f", "lavfi", "-i", f"testsrc=size={SIZE[0]}x{SIZE[1]}:rate=30:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={duration}",
+        source_path
+    ])
+    transition.normalize_video(source_path, str(path), *SIZE)
+    return str(path)
+
+def render(input_paths, segment_times, transition_types, output_path):
+    """Render a timeline over the inputs through final_filter_graph and return the output duration."""
+    timeline = transition.build_final_timeline(segment_times, transition_types, SIZE)
+    input_durations = [probe_duration(path) for path in input_paths]
+    run_ffmpeg([
+        *(arg for path in input_paths for arg in ("-i", path)),
+        "-filter_complex", transition.final_filter_graph(timeline, input_durations, True),
+        "-map", "[vout]", "-map", "[aout]",
+        *h264_codec_args(), "-c:a", "aac",
+        str(output_path)
+    ])
+    return probe_duration(str(output_path))
+
+def test_crossfade_after_cut_and_short_segments(tmp_path):
+    video = make_video(tmp_path / "input.mp4", 8)
+    # Crossfades follow a plain cut, and two segments are shorter than the one-second blend
+    duration = render([video], [0, 0.5, 4, 4.4, 8], ["crossfade", "fade", "crossfade"], tmp_path / "final.mp4")
+    # Each blend overlaps by the shorter of the two clips it joins: 0.5 s and 0.4 s
+    assert duration == pytest.approx(8 - 0.5 - 0.4, abs=0.2)
+
+def test_crossfades_around_segment_spanning_two_uploads(tmp_path):
+    videos = [make_video(tmp_path / "first.mp4", 4), make_video(tmp_path / "second.mp4", 4)]
+    # The middle segment runs from the first upload into the second and is crossfaded on both sides
+    duration = render(videos, [0, 2, 6, 8], ["crossfade", "crossfade"], tmp_path / "final.mp4")
+    assert duration == pytest.approx(8 - 1 - 1, abs=0.2)
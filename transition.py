@@ -1,64 +1,245 @@
 import streamlit as st
-from moviepy.editor import VideoFileClip, concatenate_videoclips, vfx
+from moviepy.editor import VideoFileClip, concatenate_videoclips
 import tempfile
 import os
+import shutil
 import logging
+import re
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from ffmpeg_utils import (
+    can_concat_copy, concat_segments, h264_codec_args, h264_encoder, has_audio, probe_duration, probe_frame_size,
+    run_ffmpeg
+)
 
 logging.basicConfig(level=logging.INFO)
 
-def show_transition(clip1, clip2, transition, duration):
-    """Apply a specified transition between two clips."""
-    if transition == "crossfade":
-        return [clip1.crossfadeout(duration), clip2.crossfadein(duration)]
-    elif transition == "fade":
-        return [clip1.fadeout(duration), clip2.fadein(duration)]
-    elif transition == "mirrorx":
-        return [clip1, clip2.fx(vfx.mirror_x)]
-    elif transition == "mirrory":
-        return [clip1, clip2.fx(vfx.mirror_y)]
-    elif transition == "blackwhite":
-        return [clip1, clip2.fx(vfx.blackwhite)]
-    elif transition == "blur":
-        return [clip1, clip2.fx(vfx.blur, size=10)]
-    elif transition == "zoom_in":
-        return [clip1, clip2.fx(vfx.resize, newsize=(clip2.w * 1.2, clip2.h * 1.2))]
-    elif transition == "zoom_out":
-        return [clip1, clip2.fx(vfx.resize, newsize=(clip2.w * 0.8, clip2.h * 0.8))]
-    elif transition == "invert_colors":
-        return [clip1, clip2.fx(vfx.invert_colors)]
-    elif transition == "brightness":
-        return [clip1, clip2.fx(vfx.colorx, 1.5)]
-    else:
-        return [clip1, clip2]
+# Frame rate every upload is normalized to; normalized files also get a keyframe every second
+NORMALIZED_FPS = 24
+
+# libx264 settings for the final render; the preview keeps the shared ultrafast, zero-latency defaults
+FINAL_X264_PARAMS = ("-preset", "fast", "-crf", "23", "-pix_fmt", "yuv420p")
+
+# Comma-separated non-negative numbers, at least two of them
+SEGMENT_TIMES_PATTERN = re.compile(r"\s*\d+(\.\d*)?(\s*,\s*\d+(\.\d*)?)+\s*")
+
+# Transitions that blend the two clips together, mapped to the ffmpeg xfade transition that renders them
+BLENDED_TRANSITIONS = {"crossfade": "fade"}
+
+def fade_filters(clip1, clip2, duration, size):
+    """Fade the first clip out and the second one in."""
+    fade_start = max(clip1[1] - clip1[0] - duration, 0)
+    return [f"fade=t=out:st={fade_start:.3f}:d={duration}", f"fade=t=in:st=0:d={duration}"]
+
+def second_clip_filter(video_filter):
+    """Build a transition that applies a fixed filter to the second clip only."""
+    return lambda clip1, clip2, duration, size: [None, video_filter]
+
+# Each transition maps (clip1, clip2, duration, size) to the ffmpeg video filters (None for unchanged)
+# applied to the two (start, end) clips around it; size is the (width, height) the zoom filters keep
+TRANSITIONS = {
+    "crossfade": second_clip_filter(None),  # Rendered by xfade/acrossfade where the clips are joined
+    "fade": fade_filters,
+    "mirrorx": second_clip_filter("hflip"),
+    "mirrory": second_clip_filter("vflip"),
+    "blackwhite": second_clip_filter("hue=s=0"),
+    "blur": second_clip_filter("gblur=sigma=10"),
+    "zoom_in": lambda clip1, clip2, duration, size: [
+        None, f"crop=iw/1.2:ih/1.2,scale={size[0]}:{size[1]},setsar=1"
+    ],
+    "zoom_out": lambda clip1, clip2, duration, size: [
+        None, f"scale=iw*0.8:ih*0.8,pad={size[0]}:{size[1]}:(ow-iw)/2:(oh-ih)/2,setsar=1"
+    ],
+    "invert_colors": second_clip_filter("negate"),
+    "brightness": second_clip_filter("colorchannelmixer=rr=1.5:gg=1.5:bb=1.5"),
+}
+SUPPORTED_TRANSITIONS = frozenset(TRANSITIONS)
+NO_TRANSITION = second_clip_filter(None)
+
+def apply_transition(clip1, clip2, transition, duration, size):
+    """Returns the ffmpeg video filters (None for unchanged) applied to two (start, end) clips around a transition."""
+    return TRANSITIONS.get(transition, NO_TRANSITION)(clip1, clip2, duration, size)
+
+def normalize_video(input_path, output_path, width, height):
+    """Re-encode an upload to the shared frame size, frame rate, pixel format and audio layout."""
+    run_ffmpeg([
+        "-i", input_path,
+        # Pad like MoviePy's compose: centred on a black canvas of the largest upload's size, with square pixels
+        "-vf", f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={NORMALIZED_FPS},format=yuv420p",
+        *h264_codec_args(), "-g", str(NORMALIZED_FPS), "-force_key_frames", "expr:gte(t,n_forced)",
+        "-c:a", "aac", "-ar", "44100", "-ac", "2",
+        output_path
+    ])
+
+def concat_method(clips):
+    """Chain same-sized clips end to end; only mixed sizes need compose's per-frame compositing."""
+    return "chain" if len({tuple(clip.size) for clip in clips}) == 1 else "compose"
+
+def build_final_timeline(segment_times, transition_types, size):
+    """
+    Cut the timeline at the segment times into (start, end, filter, blend) clips with each transition's filters.
+    blend is None, or an (xfade transition, duration) pair for blending the clip with the one before it.
+    """
+    # Create subclips based on segment times
+    clips = [(segment_times[i], segment_times[i + 1]) for i in range(len(segment_times) - 1)]
+
+    # Add transitions; a clip between two cuts takes the filters of both
+    video_filters = [[] for _ in clips]
+    blends = [None] * len(clips)
+    for i in range(len(clips) - 1):
+        filter1, filter2 = apply_transition(clips[i], clips[i + 1], transition_types[i], duration=1.0, size=size)
+        video_filters[i] += [filter1] if filter1 else []
+        video_filters[i + 1] += [filter2] if filter2 else []
+        if transition_types[i] in BLENDED_TRANSITIONS:
+            blends[i + 1] = (BLENDED_TRANSITIONS[transition_types[i]], 1.0)
+
+    return [
+        (start, end, ",".join(clip_filters) or None, blend)
+        for (start, end), clip_filters, blend in zip(clips, video_filters, blends)
+    ]
+
+def input_pieces(start, end, input_durations):
+    """Map a (start, end) span of the joined timeline to (input index, start, end) pieces of the inputs it covers."""
+    pieces = []
+    offset = 0
+    for index, duration in enumerate(input_durations):
+        piece_start, piece_end = max(start - offset, 0), min(end - offset, duration)
+        if piece_end > piece_start:
+            pieces.append((index, piece_start, piece_end))
+        offset += duration
+    if not pieces:
+        raise ValueError(f"Segment {start:g}-{end:g} starts after the end of the uploaded videos.")
+    return pieces
+
+def final_filter_graph(timeline, input_durations, with_audio):
+    """
+    Build a filter graph that cuts the (start, end, filter, blend) clips out of the inputs played back to back
+    and joins them in order, with xfade and acrossfade where a clip blends into the previous one and concat
+    everywhere else. A clip spanning several inputs is joined from its pieces first.
+    Every joined stream is reset to the AV_TIME_BASE time base that concat outputs and pinned to a constant
+    frame rate, since xfade needs both of its inputs on the same time base and frame rate, and blends are
+    shortened to fit within both clips they join.
+    """
+    filters = []
+    lengths = []
+    for i, (start, end, video_filter, _) in enumerate(timeline):
+        pieces = input_pieces(start, end, input_durations)
+        lengths.append(sum(piece_end - piece_start for _, piece_start, piece_end in pieces))
+        labels = []
+        for j, (index, piece_start, piece_end) in enumerate(pieces):
+            filters.append(f"[{index}:v]trim=start={piece_start:.3f}:end={piece_end:.3f},setpts=PTS-STARTPTS[v{i}p{j}]")
+            labels.append(f"[v{i}p{j}]")
+            if with_audio:
+                filters.append(
+                    f"[{index}:a]atrim=start={piece_start:.3f}:end={piece_end:.3f},asetpts=PTS-STARTPTS[a{i}p{j}]"
+                )
+                labels.append(f"[a{i}p{j}]")
+
+        if len(pieces) > 1:
+            # Joining the pieces switches to concat's time base; the settb and fps below put them back in line
+            audio_outputs = f"[a{i}]" if with_audio else ""
+            filters.append(
+                f"{''.join(labels)}concat=n={len(pieces)}:v=1:a={int(with_audio)}[v{i}p]{audio_outputs}"
+            )
+            video_input = f"[v{i}p]"
+        else:
+            video_input = labels[0]
+            if with_audio:
+                filters.append(f"{labels[1]}anull[a{i}]")
+        filters.append(f"{video_input}{video_filter + ',' if video_filter else ''}settb=AVTB,fps={NORMALIZED_FPS}[v{i}]")
+
+    video, audio = "[v0]", "[a0]"
+    length = lengths[0]
+    for i, (_, _, _, blend) in enumerate(timeline[1:], start=1):
+        if blend:
+            transition, duration = blend
+            duration = min(duration, lengths[i - 1], lengths[i])
+            filters.append(
+                f"{video}[v{i}]xfade=transition={transition}:duration={duration:.3f}:offset={length - duration:.3f},"
+                f"settb=AVTB,fps={NORMALIZED_FPS}[vj{i}]"
+            )
+            if with_audio:
+                filters.append(f"{audio}[a{i}]acrossfade=d={duration:.3f}[aj{i}]")
+            length += lengths[i] - duration
+        else:
+            if with_audio:
+                filters.append(f"{video}{audio}[v{i}][a{i}]concat=n=2:v=1:a=1[vc{i}][aj{i}]")
+            else:
+                filters.append(f"{video}[v{i}]concat=n=2:v=1:a=0[vc{i}]")
+            filters.append(f"[vc{i}]settb=AVTB,fps={NORMALIZED_FPS}[vj{i}]")
+            length += lengths[i]
+        video, audio = f"[vj{i}]", f"[aj{i}]"
+
+    filters.append(f"{video}null[vout]")
+    if with_audio:
+        filters.append(f"{audio}anull[aout]")
+    return ";".join(filters)
 
 st.title("Video Processor with Transitions")
 st.write("Upload multiple videos, add transitions, and process them into a final output.")
 
 uploaded_files = st.file_uploader("Upload video files", type=["mp4", "avi", "mov"], accept_multiple_files=True)
 if uploaded_files:
-    temp_dir = tempfile.mkdtemp()
-    video_clips = []
+    # Keep one temporary directory per session so saved uploads and normalized files survive reruns
+    if not os.path.isdir(st.session_state.get("transition_temp_dir", "")):
+        st.session_state.transition_temp_dir = tempfile.mkdtemp()
+    temp_dir = st.session_state.transition_temp_dir
+    video_paths = []
 
     for uploaded_file in uploaded_files:
         input_path = os.path.join(temp_dir, uploaded_file.name)
 
-        # Save each uploaded file to the temporary directory
-        with open(input_path, "wb") as f:
-            f.write(uploaded_file.read())
+        # Save each uploaded file to the temporary directory, unless a rerun already did
+        if not os.path.exists(input_path) or os.path.getsize(input_path) != uploaded_file.size:
+            with open(input_path, "wb") as f:
+                shutil.copyfileobj(uploaded_file, f, length=1 << 20)
 
-        video = VideoFileClip(input_path)
-        video_clips.append(video)
+        video_paths.append(input_path)
 
-    st.write(f"Number of videos uploaded: {len(video_clips)}")
+    # Normalize every upload once, in parallel, so the preview can always be joined by stream copy
+    sizes = [probe_frame_size(path) for path in video_paths]
+    canvas = (max(w for w, _ in sizes) + 1) // 2 * 2, (max(h for _, h in sizes) + 1) // 2 * 2
+    # The name carries the canvas size, so adding a larger upload re-normalizes the others, and the full
+    # upload name, so clip.mp4 and clip.mov don't share one output
+    normalized_paths = [
+        os.path.join(temp_dir, f"normalized_{canvas[0]}x{canvas[1]}_{os.path.basename(path)}.mp4")
+        for path in video_paths
+    ]
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(
+            lambda paths: normalize_video(*paths, *canvas),
+            [
+                (path, normalized_path) for path, normalized_path in zip(video_paths, normalized_paths)
+                if not os.path.exists(normalized_path) or os.path.getmtime(normalized_path) < os.path.getmtime(path)
+            ]
+        ))
+    video_paths = normalized_paths
+    # Durations come from the containers, so no clip (and its ffmpeg reader) stays open across reruns
+    input_durations = [probe_duration(path) for path in video_paths]
 
-    if len(video_clips) > 1:
+    st.write(f"Number of videos uploaded: {len(video_paths)}")
+
+    if len(video_paths) > 1:
         st.write("Preview concatenated video below:")
-        preview_video = concatenate_videoclips(video_clips, method="compose")
         preview_path = os.path.join(temp_dir, "preview_video.mp4")
-        preview_video.write_videofile(preview_path, codec="libx264", fps=24, audio_codec="aac")
+        codec, ffmpeg_params = h264_encoder()
+        if can_concat_copy(video_paths):
+            # Uploads with matching codecs and layout are joined without decoding or re-encoding
+            concat_segments([(path, None, None) for path in video_paths], preview_path)
+        else:
+            video_clips = [VideoFileClip(path) for path in video_paths]
+            try:
+                preview_video = concatenate_videoclips(video_clips, method=concat_method(video_clips))
+                # Frame-parallel encoding on every core; MoviePy otherwise leaves ffmpeg's thread count unset
+                preview_video.write_videofile(
+                    preview_path, codec=codec, ffmpeg_params=[*ffmpeg_params, "-thread_type", "frame"], fps=24,
+                    audio_codec="aac", threads=os.cpu_count()
+                )
+            finally:
+                for clip in video_clips:
+                    clip.close()
 
-        with open(preview_path, "rb") as f:
-            st.video(f.read())
+        st.video(preview_path)
 
         segments = st.text_input("Enter segment times for final processing (comma-separated, e.g., 0,5,10)")
         transitions = st.text_input("Enter transitions (comma-separated, e.g., crossfade,fade)")
@@ -67,62 +248,58 @@ if uploaded_files:
             try:
                 output_path = os.path.join(temp_dir, "final_video.mp4")
 
-                # Parse segments and transitions
-                segment_times = [float(t) for t in segments.split(",")]
-                transition_types = transitions.split(",")
+                # Validate, then parse segments and transitions
+                if not SEGMENT_TIMES_PATTERN.fullmatch(segments):
+                    st.error("Segment times must be two or more comma-separated numbers.")
+                    raise ValueError("Invalid segment input.")
+                segment_times = np.fromstring(segments, sep=",", dtype=np.float64)
+                if np.any(np.diff(segment_times) <= 0):
+                    st.error("Segment times must be increasing.")
+                    raise ValueError("Invalid segment input.")
+
+                transition_types = [t.strip() for t in transitions.split(",")] if transitions.strip() else []
+                if not set(transition_types) <= SUPPORTED_TRANSITIONS:
+                    st.error(f"Unknown transitions: {', '.join(sorted(set(transition_types) - SUPPORTED_TRANSITIONS))}")
+                    raise ValueError("Invalid transition input.")
 
                 if len(transition_types) != len(segment_times) - 2:
                     st.error("Number of transitions must match the number of cuts between segments.")
                     raise ValueError("Invalid transition input.")
 
-                # Create subclips based on segment times
-                clips = [preview_video.subclip(segment_times[i], segment_times[i + 1]) for i in range(len(segment_times) - 1)]
-
-                # Add transitions
-                final_clips = []
-                for i in range(len(clips) - 1):
-                    clip1, clip2 = clips[i], clips[i + 1]
-                    transitioned_clips = apply_transition(clip1, clip2, transition_types[i], duration=1.0)
-                    final_clips.append(transitioned_clips[0])
-                    final_clips.append(transitioned_clips[1])
-
-                final_clips.append(clips[-1])  # Add the last clip without transition
-
-                # Concatenate all clips
-                final_video = concatenate_videoclips(final_clips, method="compose")
-                final_video.write_videofile(output_path, codec="libx264", fps=24, audio_codec="aac")
+                # Cut, apply every effect and join in one ffmpeg graph instead of per-frame Python callbacks
+                timeline = build_final_timeline(segment_times, transition_types, canvas)
+                # Read the normalized uploads directly, so the final render no longer depends on the preview file
+                with_audio = all(has_audio(path) for path in video_paths)
+                run_ffmpeg([
+                    *(arg for path in video_paths for arg in ("-i", path)),
+                    "-filter_complex", final_filter_graph(timeline, input_durations, with_audio),
+                    "-map", "[vout]", *(["-map", "[aout]"] if with_audio else []),
+                    *h264_codec_args(software_params=FINAL_X264_PARAMS), "-c:a", "aac",
+                    output_path
+                ])
 
                 st.success("Final video processed successfully!")
 
-                # Display the final video in the app
+                # Display the final video in the app, reading it once for the player and the download button
                 with open(output_path, "rb") as f:
-                    st.video(f.read())
+                    video_bytes = f.read()
+                st.video(video_bytes)
 
                 # Optionally allow the user to download the final video
-                with open(output_path, "rb") as f:
-                    st.download_button(
-                        label="Download Final Video",
-                        data=f,
-                        file_name="final_video.mp4",
-                        mime="video/mp4",
-                    )
+                st.download_button(
+                    label="Download Final Video",
+                    data=video_bytes,
+                    file_name="final_video.mp4",
+                    mime="video/mp4",
+                )
 
             except Exception as e:
                 st.error(f"Error processing final video: {str(e)}")
 
             finally:
                 # Cleanup temporary files
-                if temp_dir and os.path.exists(temp_dir):
-                    try:
-                        for file in os.listdir(temp_dir):
-                            os.remove(os.path.join(temp_dir, file))
-                        os.rmdir(temp_dir)
-                    except Exception as cleanup_error:
-                        logging.warning(f"Error during cleanup: {cleanup_error}")
+                st.session_state.pop("transition_temp_dir", None)
+                shutil.rmtree(temp_dir, ignore_errors=True)
 
     else:
-        st.warning("Please upload more than one video to process transitions.")
-
-    # Close video files
-    for video in video_clips:
-        video.close()
\ No newline at end of file
+        st.warning("Please upload more than one video to process transitions.")
\ No newline at end of file
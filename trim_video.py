@@ -1,7 +1,61 @@
 import streamlit as st
-from moviepy.editor import VideoFileClip
 import tempfile
 import os
+import shutil
+from ffmpeg_utils import (
+    MP4_AUDIO_CODECS, h264_codec_args, on_keyframes, probe_audio_codec, probe_duration, probe_video_codec, run_ffmpeg
+)
+
+def trim_upload(uploaded_file, temp_dir):
+    """Show the trim controls for an upload, keeping its files in temp_dir."""
+    # Save uploaded file temporarily
+    input_path = os.path.join(temp_dir, "input" + os.path.splitext(uploaded_file.name)[1])
+    with open(input_path, "wb") as f:
+        shutil.copyfileobj(uploaded_file, f, length=1 << 20)
+    
+    # Read the duration from the container; trimming doesn't need a decoder
+    duration = probe_duration(input_path)
+    
+    st.video(uploaded_file)
+    
+    # Trim controls
+    st.markdown("### Trim Settings")
+    start_time = st.slider("Start Time (seconds)", 0, int(duration), 0)
+    end_time = st.slider("End Time (seconds)", 0, int(duration), int(duration))
+    
+    if st.button("Trim Video"):
+        if start_time < end_time:
+            # Save trimmed video, copying H.264 packets when the start is a keyframe and re-encoding otherwise
+            output_path = os.path.join(temp_dir, "trimmed_video.mp4")
+            if probe_video_codec(input_path) == "h264" and on_keyframes(input_path, [start_time]):
+                audio_codec = probe_audio_codec(input_path)
+                audio_args = ["-c:a", "copy"] if not audio_codec or audio_codec in MP4_AUDIO_CODECS else ["-c:a", "aac"]
+                codec_args = ["-c:v", "copy", *audio_args, "-avoid_negative_ts", "make_zero"]
+            else:
+                codec_args = [*h264_codec_args(), "-c:a", "aac"]
+            run_ffmpeg([
+                "-ss", str(start_time), "-i", input_path,
+                "-t", str(end_time - start_time),
+                *codec_args,
+                output_path
+            ])
+            
+            st.success("Video trimmed successfully!")
+            # Read the output once for both the player and the download button
+            with open(output_path, "rb") as f:
+                video_bytes = f.read()
+            st.video(video_bytes)
+            
+            # Add download button
+            st.download_button(
+                label="Download Trimmed Video",
+                data=video_bytes,
+                file_name="trimmed_video.mp4",
+                mime="video/mp4"
+            )
+            
+        else:
+            st.error("End time must be greater than start time!")
 
 def show_trim_video():
     st.title("Trim Video ✂️")
@@ -9,47 +63,6 @@ def show_trim_video():
     uploaded_file = st.file_uploader("Upload your video", type=['mp4', 'mov', 'avi'])
     
     if uploaded_file is not None:
-        # Save uploaded file temporarily
-        tfile = tempfile.NamedTemporaryFile(delete=False)
-        tfile.write(uploaded_file.read())
-        tfile.close()  # Close the file to ensure it's not being used
-        
-        # Load video
-        video = VideoFileClip(tfile.name)
-        duration = video.duration
-        
-        st.video(uploaded_file)
-        
-        # Trim controls
-        st.markdown("### Trim Settings")
-        start_time = st.slider("Start Time (seconds)", 0, int(duration), 0)
-        end_time = st.slider("End Time (seconds)", 0, int(duration), int(duration))
-        
-        if st.button("Trim Video"):
-            if start_time < end_time:
-                trimmed = video.subclip(start_time, end_time)
-                
-                # Save trimmed video
-                output_path = "temp_trimmed.mp4"
-                trimmed.write_videofile(output_path)
-                
-                st.success("Video trimmed successfully!")
-                st.video(output_path)
-                
-                # Add download button
-                with open(output_path, "rb") as f:
-                    st.download_button(
-                        label="Download Trimmed Video",
-                        data=f,
-                        file_name="trimmed_video.mp4",
-                        mime="video/mp4"
-                    )
-                
-                # Cleanup
-                video.close()
-                trimmed.close()
-                os.unlink(tfile.name)
-                os.remove(output_path)
-                
-            else:
-                st.error("End time must be greater than start time!")
+        # Everything written for this run lives in one directory that is removed on exit
+        with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as temp_dir:
+            trim_upload(uploaded_file, temp_dir)
\ No newline at end of file